@@ -0,0 +1,354 @@
+import os
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from pymilvus import connections, Collection, MilvusClient
+from dotenv import load_dotenv
+from coarse_vectors import COARSE_FIELD, COARSE_OVERFETCH, FIT_SAMPLE, fit_projection, load_projection, rescore
+from collection_schema import coarse_dim_of, vector_dtype_of
+from exact_search import empty_top_k, merge_top_k, normalize, sort_top_k
+from index_profiles import (
+    INDEX_PROFILES, METRIC_TYPE, VECTOR_FIELD, build_vector_index, drop_vector_index, get_search_params
+)
+from rebuild_index import index_field, migrate_index
+from vector_codec import client_vector_dtype, decode_vector, encode_queries
+from vector_sidecar import list_sidecars, read_sidecar, sidecar_exists, write_sidecar
+
+# ==== 配置 ====
+load_dotenv()
+MILVUS_URI = os.getenv("MILVUS_URI", "http://localhost:19530")  # 也可以是 Milvus Lite 的本地 .db 文件
+COLLECTION_NAME = os.getenv("COLLECTION_NAME", "pubmed_rare_disease_db")
+EXPORT_BASE = "benchmark_export"  # 导出的 pmid + float32 向量（vector_sidecar 格式）
+EXPORT_BATCH = 1000
+GT_BLOCK = 8192                   # 暴力求真值时每块的向量数，控制内存
+CONCURRENCY_LEVELS = [1, 4, 16]
+COARSE_OVERFETCHES = [2, 4, 8]
+# 每种索引扫描的检索参数
+SWEEP_PARAMS: Dict[str, Tuple[Optional[str], List]] = {
+    "FLAT": (None, [None]),
+    "IVF_FLAT": ("nprobe", [1, 4, 8, 16, 32, 64, 128]),
+    "IVF_SQ8": ("nprobe", [1, 4, 8, 16, 32, 64, 128]),
+    "IVF_PQ": ("nprobe", [1, 4, 8, 16, 32, 64, 128]),
+    "HNSW": ("ef", [16, 32, 64, 128, 256]),
+    "DISKANN": ("search_list", [20, 50, 100, 200]),
+}
+
+
+# ==== 向量导出：从集合中拉取全部 pmid + 向量，作为暴力检索的底库 ====
+def export_embeddings(collection: Collection, base_path: str) -> Tuple[List[str], np.ndarray]:
+    print(f"📤 正在导出 {collection.num_entities} 条向量 → {base_path}.npy")
+    pmids, vectors = [], []
+    vector_dtype = vector_dtype_of(collection)
+    iterator = collection.query_iterator(batch_size=EXPORT_BATCH, output_fields=["pmid", VECTOR_FIELD])
+    while True:
+        batch = iterator.next()
+        if not batch:
+            break
+        pmids.extend(row["pmid"] for row in batch)
+        vectors.extend(decode_vector(row[VECTOR_FIELD], vector_dtype) for row in batch)
+    iterator.close()
+    write_sidecar(base_path, [{"pmid": p} for p in pmids], vectors)
+    return read_base([base_path])
+
+
+def read_base(base_paths: List[str]) -> Tuple[List[str], np.ndarray]:
+    pmids, blocks = [], []
+    for base_path in base_paths:
+        records, vectors = read_sidecar(base_path)
+        pmids.extend(r["pmid"] for r in records)
+        blocks.append(np.asarray(vectors, dtype=np.float32))
+    return pmids, np.concatenate(blocks)
+
+
+# ==== NumPy 暴力检索求精确 top-k（分块合并见 exact_search） ====
+def exact_top_k(base: np.ndarray, queries: np.ndarray, k: int, block: int = GT_BLOCK) -> np.ndarray:
+    queries = normalize(queries)
+    best_scores, best_ids = empty_top_k(len(queries))
+    for start in range(0, len(base), block):
+        chunk = normalize(np.asarray(base[start:start + block], dtype=np.float32))
+        best_scores, best_ids = merge_top_k(best_scores, best_ids, queries @ chunk.T,
+                                            np.arange(start, start + len(chunk)), k)
+    return sort_top_k(best_scores, best_ids)[1]
+
+
+def load_queries(args, base: np.ndarray) -> np.ndarray:
+    if args.queries:
+        from embedding_client import get_embeddings  # 只有文本查询集才需要 embedding 服务
+        with open(args.queries, "r", encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+        print(f"🧠 正在向量化 {len(texts)} 条查询")
+        return np.asarray(get_embeddings(texts), dtype=np.float32)
+    # 未提供查询集时从底库随机抽样，并加少量噪声，避免查询与自身完全重合
+    rng = np.random.default_rng(args.seed)
+    rows = rng.choice(len(base), size=min(args.sample, len(base)), replace=False)
+    queries = normalize(np.asarray(base[np.sort(rows)], dtype=np.float32))
+    return queries + rng.normal(0, args.noise, queries.shape).astype(np.float32)
+
+
+# ==== 按给定并发度跑完全部查询，记录每次请求的延迟 ====
+def run_queries(client: MilvusClient, collection_name: str, queries: np.ndarray, k: int,
+                search_params: Dict, concurrency: int) -> Tuple[List[List[str]], np.ndarray, float]:
+    vector_dtype = client_vector_dtype(client, collection_name)
+
+    def one(vector: np.ndarray) -> Tuple[List[str], float]:
+        started = time.perf_counter()
+        result = client.search(
+            collection_name=collection_name,
+            data=encode_queries([vector.tolist()], vector_dtype),
+            anns_field=VECTOR_FIELD,
+            search_params=search_params,
+            limit=k,
+            output_fields=["pmid"],
+            consistency_level="Bounded"
+        )
+        return [hit["entity"]["pmid"] for hit in result[0]], time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outputs = list(pool.map(one, queries))
+    wall = time.perf_counter() - started
+    return [o[0] for o in outputs], np.asarray([o[1] for o in outputs]), wall
+
+
+# ==== 粗排 + 重排：低维字段召回 k × overfetch 条候选，按主键取完整向量重新打分 ====
+def run_coarse_queries(client: MilvusClient, collection_name: str, queries: np.ndarray, k: int, overfetch: int,
+                       concurrency: int, projection,
+                       search_params: Optional[Dict] = None) -> Tuple[List[List[str]], np.ndarray, float]:
+    vector_dtype = client_vector_dtype(client, collection_name)
+    search_params = search_params or get_search_params()
+
+    def one(vector: np.ndarray) -> Tuple[List[str], float]:
+        started = time.perf_counter()
+        result = client.search(
+            collection_name=collection_name,
+            data=projection.project([vector]).tolist(),
+            anns_field=COARSE_FIELD,
+            search_params=search_params,
+            limit=k * overfetch,
+            output_fields=["pmid"],
+            consistency_level="Bounded"
+        )
+        candidates = [hit["entity"]["pmid"] for hit in result[0]]
+        rows = client.query(collection_name=collection_name, filter=f"pmid in {json.dumps(candidates)}",
+                            output_fields=["pmid", VECTOR_FIELD], consistency_level="Bounded") if candidates else []
+        if not rows:
+            return [], time.perf_counter() - started
+        scores = rescore(vector, np.stack([decode_vector(row[VECTOR_FIELD], vector_dtype) for row in rows]))
+        return [rows[i]["pmid"] for i in np.argsort(-scores)[:k]], time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outputs = list(pool.map(one, queries))
+    wall = time.perf_counter() - started
+    return [o[0] for o in outputs], np.asarray([o[1] for o in outputs]), wall
+
+
+def recall_at_k(results: List[List[str]], truth: List[List[str]], k: int) -> float:
+    return float(np.mean([len(set(r[:k]) & set(t[:k])) / k for r, t in zip(results, truth)]))
+
+
+def current_index(collection: Collection, field: str = VECTOR_FIELD) -> Optional[Dict]:
+    return next((dict(i.params) for i in collection.indexes if i.field_name == field), None)
+
+
+# ==== 对当前索引扫描检索参数 × 并发度 ====
+def sweep_index(client: MilvusClient, collection: Collection, queries: np.ndarray, truth: List[List[str]],
+                k: int, concurrency_levels: List[int], label: str) -> List[Dict]:
+    # 与 rebuild_index 一致：有粗排字段时档位作用于粗排字段，按检索服务的粗排 + 重排路径评测
+    field = index_field(collection)
+    if field == COARSE_FIELD:
+        projection = load_projection(coarse_dim_of(collection))
+
+        def run(batch: np.ndarray, search_params: Dict, concurrency: int):
+            return run_coarse_queries(client, collection.name, batch, k, COARSE_OVERFETCH, concurrency, projection,
+                                      search_params)
+    else:
+        def run(batch: np.ndarray, search_params: Dict, concurrency: int):
+            return run_queries(client, collection.name, batch, k, search_params, concurrency)
+
+    index = current_index(collection, field) or {}
+    index_type = index.get("index_type", "FLAT")
+    nlist = int(index.get("params", {}).get("nlist", 0) or 0)
+    param_name, values = SWEEP_PARAMS.get(index_type, (None, [None]))
+    if param_name == "nprobe" and nlist:
+        values = [v for v in values if v <= nlist]
+    if param_name == "ef":
+        values = [v for v in values if v >= k]  # HNSW 要求 ef >= limit
+
+    rows = []
+    for value in values:
+        params = {param_name: value} if param_name else {}
+        search_params = {"metric_type": METRIC_TYPE, "params": params}
+        run(queries[:min(len(queries), 20)], search_params, 1)  # 预热
+        for concurrency in concurrency_levels:
+            results, latencies, wall = run(queries, search_params, concurrency)
+            row = {
+                "profile": label,
+                "field": field,
+                "index_type": index_type,
+                "param": f"{param_name}={value}" if param_name else "-",
+                "concurrency": concurrency,
+                f"recall@{k}": round(recall_at_k(results, truth, k), 4),
+                "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 2),
+                "p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 2),
+                "p99_ms": round(float(np.percentile(latencies, 99)) * 1000, 2),
+                "qps": round(len(queries) / wall, 1),
+            }
+            rows.append(row)
+            print_row(row, k)
+    return rows
+
+
+def sweep_coarse(client: MilvusClient, collection: Collection, queries: np.ndarray, truth: List[List[str]],
+                 k: int, concurrency_levels: List[int], overfetches: List[int]) -> List[Dict]:
+    # 集合带粗排字段时，按 overfetch × 并发度评测检索服务实际走的粗排 + 重排路径
+    projection = load_projection(coarse_dim_of(collection))
+    rows = []
+    for overfetch in overfetches:
+        run_coarse_queries(client, collection.name, queries[:min(len(queries), 20)], k, overfetch, 1,  # 预热
+                           projection)
+        for concurrency in concurrency_levels:
+            results, latencies, wall = run_coarse_queries(client, collection.name, queries, k, overfetch, concurrency,
+                                                          projection)
+            row = {
+                "profile": f"{projection.method}-{projection.dim}",
+                "index_type": "COARSE",
+                "param": f"overfetch={overfetch}",
+                "concurrency": concurrency,
+                f"recall@{k}": round(recall_at_k(results, truth, k), 4),
+                "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 2),
+                "p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 2),
+                "p99_ms": round(float(np.percentile(latencies, 99)) * 1000, 2),
+                "qps": round(len(queries) / wall, 1),
+            }
+            rows.append(row)
+            print_row(row, k)
+    return rows
+
+
+# ==== 离线评测降维方式：NumPy 暴力检索，对比截断 / PCA 在不同维度与候选倍数下的召回率与计算量 ====
+def coarse_top_k(base: np.ndarray, coarse_base: np.ndarray, queries: np.ndarray, projection, k: int,
+                 overfetch: int) -> List[np.ndarray]:
+    candidates = exact_top_k(coarse_base, projection.project(queries), k * overfetch)
+    # 一次取出全部查询的候选向量 (查询数, 候选数, dim)，批量计算余弦相似度
+    vectors = np.asarray(base[candidates], dtype=np.float32)
+    scores = np.einsum("qcd,qd->qc", vectors, normalize(queries)) / np.maximum(np.linalg.norm(vectors, axis=2), 1e-12)
+    return list(np.take_along_axis(candidates, np.argsort(-scores, axis=1)[:, :k], axis=1))
+
+
+def sweep_coarse_offline(base: np.ndarray, pmids: List[str], queries: np.ndarray, truth: List[List[str]], k: int,
+                         methods: List[str], dims: List[int], overfetches: List[int], seed: int) -> List[Dict]:
+    started = time.perf_counter()
+    exact_top_k(base, queries, k)
+    full_ms = (time.perf_counter() - started) / len(queries) * 1000
+    rng = np.random.default_rng(seed)
+    sample = base[np.sort(rng.choice(len(base), size=min(FIT_SAMPLE, len(base)), replace=False))]
+    rows = []
+    for method in methods:
+        for dim in dims:
+            if method == "pca" and dim > len(sample):
+                print(f"  ⚠️ 跳过 pca-{dim}：底库只有 {len(sample)} 条，不足以学习 {dim} 维 PCA")
+                continue
+            projection = fit_projection(sample, method, dim)
+            coarse_base = projection.project(base)
+            for overfetch in overfetches:
+                started = time.perf_counter()
+                results = coarse_top_k(base, coarse_base, queries, projection, k, overfetch)
+                row = {
+                    "profile": f"{method}-{dim}",
+                    "index_type": "NUMPY",
+                    "param": f"overfetch={overfetch}",
+                    f"recall@{k}": round(recall_at_k([[pmids[i] for i in ids] for ids in results], truth, k), 4),
+                    "ms_per_query": round((time.perf_counter() - started) / len(queries) * 1000, 3),
+                    "full_ms_per_query": round(full_ms, 3),
+                    "memory_ratio": round(dim / base.shape[1], 3),
+                }
+                rows.append(row)
+                print(f"  {row['profile']:<14} {row['param']:<16} recall@{k}={row[f'recall@{k}']:.4f}  "
+                      f"{row['ms_per_query']:.3f}ms/q（完整向量 {full_ms:.3f}ms/q）  "
+                      f"粗排向量内存 = 完整的 {row['memory_ratio']:.0%}")
+    return rows
+
+
+def print_row(row: Dict, k: int):
+    print(f"  {row['profile']:<14} {row['param']:<16} c={row['concurrency']:<3} "
+          f"recall@{k}={row[f'recall@{k}']:.4f}  p50={row['p50_ms']:.2f}ms  p95={row['p95_ms']:.2f}ms  "
+          f"p99={row['p99_ms']:.2f}ms  qps={row['qps']:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检索评测：暴力真值 vs 索引，统计 recall@k、延迟分位数与 QPS")
+    parser.add_argument("--uri", default=MILVUS_URI, help="Milvus 地址，或 Milvus Lite 的 .db 文件")
+    parser.add_argument("--collection", default=COLLECTION_NAME)
+    parser.add_argument("--queries", help="查询文本文件（每行一条）；不提供则从底库抽样")
+    parser.add_argument("--sample", type=int, default=200, help="抽样查询条数")
+    parser.add_argument("--noise", type=float, default=0.01, help="抽样查询附加的高斯噪声")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--concurrency", default=",".join(map(str, CONCURRENCY_LEVELS)), help="并发度列表，如 1,4,16")
+    parser.add_argument("--profiles", default="", help=f"依次重建并评测的索引档位（{','.join(INDEX_PROFILES)}），"
+                                                       "默认只评测当前索引；评测完恢复原索引")
+    parser.add_argument("--coarse", default="", help="离线评测的粗排维度列表，如 128,256,512；默认不评测")
+    parser.add_argument("--coarse-methods", default="truncate,pca", help="离线评测的降维方式（truncate / pca）")
+    parser.add_argument("--coarse-overfetch", default=",".join(map(str, COARSE_OVERFETCHES)),
+                        help="粗排候选倍数列表：先取 k × N 条候选再重排")
+    parser.add_argument("--sidecars", help="直接使用 json_embedded 等目录下的 .npy 作为底库，而不是从集合导出")
+    parser.add_argument("--export", action="store_true", help="强制重新导出集合向量")
+    parser.add_argument("--output", help="把结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    connections.connect("default", uri=args.uri)
+    client = MilvusClient(uri=args.uri)
+    collection = Collection(args.collection)
+    collection.load()
+
+    # 1. 底库与真值
+    if args.sidecars:
+        pmids, base = read_base(list_sidecars(args.sidecars))
+    elif sidecar_exists(EXPORT_BASE) and not args.export:
+        pmids, base = read_base([EXPORT_BASE])
+    else:
+        pmids, base = export_embeddings(collection, EXPORT_BASE)
+    queries = load_queries(args, base)
+    started = time.perf_counter()
+    truth_idx = exact_top_k(base, queries, args.k)
+    truth = [[pmids[i] for i in row] for row in truth_idx]
+    print(f"🎯 底库 {len(pmids)} 条，查询 {len(queries)} 条，暴力真值用时 {time.perf_counter() - started:.1f}s")
+
+    # 2. 扫描索引档位 × 检索参数 × 并发度
+    levels = [int(c) for c in args.concurrency.split(",") if c]
+    profiles = [p.strip() for p in args.profiles.split(",") if p.strip()]
+    field = index_field(collection)
+    original = current_index(collection, field)
+    overfetches = [int(o) for o in args.coarse_overfetch.split(",") if o]
+    rows = []
+    if args.coarse:
+        print("📏 离线评测粗排 + 重排（NumPy 暴力检索）")
+        rows += sweep_coarse_offline(base, pmids, queries, truth, args.k,
+                                     [m.strip() for m in args.coarse_methods.split(",") if m.strip()],
+                                     [int(d) for d in args.coarse.split(",") if d], overfetches, args.seed)
+    if coarse_dim_of(collection):
+        rows += sweep_coarse(client, collection, queries, truth, args.k, levels, overfetches)
+    try:
+        if not profiles:
+            rows += sweep_index(client, collection, queries, truth, args.k, levels, "current")
+        for profile in profiles:
+            migrate_index(collection, profile)
+            rows += sweep_index(client, collection, queries, truth, args.k, levels, profile)
+    finally:
+        if profiles and original is not None and current_index(collection, field) != original:
+            print(f"↩️ 恢复 {field} 的原向量索引")
+            drop_vector_index(collection, field)
+            build_vector_index(collection, original, field)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"k": args.k, "queries": len(queries), "base": len(pmids), "results": rows}, f, indent=2)
+        print(f"💾 结果已写入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+import os
+import argparse
+from typing import Optional
+import numpy as np
+from pymilvus import connections, Collection
+from dotenv import find_dotenv, load_dotenv
+from index_profiles import VECTOR_FIELD
+from vector_codec import decode_vector, dtype_of
+
+# ==== 配置 ====
+load_dotenv(find_dotenv(usecwd=True))
+# 粗排字段：与 embedding 并存的低维向量，先在它上面召回 top_k × COARSE_OVERFETCH 条候选，再用完整向量精确重排
+COARSE_FIELD = "embedding_coarse"
+COARSE_SCHEMA = os.getenv("COARSE_SCHEMA", "false").lower() == "true"  # 新建集合 / 迁移时是否带粗排字段
+COARSE_METHOD = os.getenv("COARSE_METHOD", "truncate")
+COARSE_DIM = int(os.getenv("COARSE_DIM", "256"))
+COARSE_OVERFETCH = int(os.getenv("COARSE_OVERFETCH", "4"))
+COARSE_PROJECTION = os.getenv(
+    "COARSE_PROJECTION",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "coarse_projection.npz")
+)
+FIT_SAMPLE = 50000
+FIT_BATCH = 1000
+
+# ==== 降维方式 ====
+# truncate  直接取前 COARSE_DIM 维（Matryoshka 训练的 embedding 前几维已包含主要信息），无需训练
+# pca       在语料向量上学习的 PCA 投影，任意 embedding 模型都适用；需先运行 python coarse_vectors.py fit
+COARSE_METHODS = ("truncate", "pca")
+
+
+class CoarseProjection:
+    def __init__(self, method: str, dim: int, mean: Optional[np.ndarray] = None,
+                 components: Optional[np.ndarray] = None):
+        if method not in COARSE_METHODS:
+            raise ValueError(f"Unknown coarse method: {method} (available: {', '.join(COARSE_METHODS)})")
+        self.method = method
+        self.dim = dim
+        self.mean = mean
+        self.components = components  # (dim, 原始维度)
+
+    def project(self, vectors) -> np.ndarray:
+        # 输出归一化的 float32，粗排字段与完整向量同样用 COSINE
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if self.method == "truncate":
+            low = matrix[:, :self.dim]
+        else:
+            low = (matrix - self.mean) @ self.components.T
+        norms = np.linalg.norm(low, axis=1, keepdims=True)
+        return np.ascontiguousarray(low / np.maximum(norms, 1e-12), dtype=np.float32)
+
+    def save(self, path: str = COARSE_PROJECTION):
+        arrays = {"method": np.asarray(self.method), "dim": np.asarray(self.dim)}
+        if self.method == "pca":
+            arrays.update(mean=self.mean, components=self.components)
+        with open(path + ".tmp", "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(path + ".tmp", path)
+
+
+def fit_projection(vectors: np.ndarray, method: str = COARSE_METHOD, dim: int = COARSE_DIM) -> CoarseProjection:
+    if method == "truncate":
+        return CoarseProjection(method, dim)
+    # 先归一化再做 PCA：检索用 COSINE，只关心方向
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if len(matrix) < dim:
+        raise ValueError(f"PCA 需要至少 {dim} 条样本向量，当前只有 {len(matrix)} 条")
+    matrix = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+    mean = matrix.mean(axis=0)
+    _, singular, vt = np.linalg.svd(matrix - mean, full_matrices=False)
+    kept = float(np.sum(singular[:dim] ** 2) / max(float(np.sum(singular ** 2)), 1e-12))
+    print(f"📐 PCA {matrix.shape[1]} → {dim} 维，保留方差 {kept:.1%}")
+    return CoarseProjection(method, dim, mean.astype(np.float32), vt[:dim].astype(np.float32))
+
+
+_projection_state = {"mtime": None, "projection": None}
+
+
+def load_projection(dim: Optional[int] = None, path: str = COARSE_PROJECTION) -> CoarseProjection:
+    # dim 为集合中粗排字段的维度（只有新建集合时为 None），入库与检索的投影必须与之一致
+    # 没有投影文件时按截断处理：维度取集合字段的维度，新建集合才用 COARSE_DIM；pca 必须先 fit
+    if not os.path.exists(path):
+        if COARSE_METHOD != "truncate":
+            raise RuntimeError(f"缺少粗排投影文件 {path}，请先运行 python coarse_vectors.py fit")
+        return CoarseProjection("truncate", dim or COARSE_DIM)
+    mtime = os.path.getmtime(path)
+    if _projection_state["mtime"] != mtime:
+        with np.load(path) as data:
+            method = str(data["method"])
+            projection = CoarseProjection(method, int(data["dim"]), data["mean"] if method == "pca" else None,
+                                          data["components"] if method == "pca" else None)
+        _projection_state.update(mtime=mtime, projection=projection)
+    projection = _projection_state["projection"]
+    if dim is not None and projection.dim != dim:
+        raise ValueError(f"粗排投影 {path} 为 {projection.dim} 维，与集合的 {COARSE_FIELD} 字段（{dim} 维）不一致；"
+                         "请使用迁移时的投影文件，或重新运行 migrate_schema.py --coarse")
+    return projection
+
+
+# ==== 精确重排：候选的完整向量与查询向量的余弦相似度 ====
+def rescore(query_vector, candidate_vectors: np.ndarray) -> np.ndarray:
+    query = np.asarray(query_vector, dtype=np.float32)
+    query = query / max(float(np.linalg.norm(query)), 1e-12)
+    norms = np.maximum(np.linalg.norm(candidate_vectors, axis=1), 1e-12)
+    return (candidate_vectors @ query) / norms
+
+
+# ==== 从集合抽样向量学习 PCA 投影 ====
+def sample_vectors(collection: Collection, sample: int = FIT_SAMPLE, seed: int = 42) -> np.ndarray:
+    vector_dtype = dtype_of(next(f for f in collection.schema.fields if f.name == VECTOR_FIELD).dtype)
+    rate = min(1.0, sample / max(collection.num_entities, 1))
+    rng = np.random.default_rng(seed)
+    picked = []
+    iterator = collection.query_iterator(batch_size=FIT_BATCH, output_fields=["pmid", VECTOR_FIELD])
+    while True:
+        rows = iterator.next()
+        if not rows:
+            break
+        picked.extend(decode_vector(rows[i][VECTOR_FIELD], vector_dtype)
+                      for i in np.flatnonzero(rng.random(len(rows)) < rate))
+    iterator.close()
+    return np.stack(picked[:sample])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="学习粗排字段的降维投影（PCA），或写入截断维度的配置")
+    parser.add_argument("command", choices=["fit"])
+    parser.add_argument("--uri", default=os.getenv("MILVUS_URI", "http://localhost:19530"),
+                        help="Milvus 地址，或 Milvus Lite 的 .db 文件")
+    parser.add_argument("--collection", default=os.getenv("COLLECTION_NAME", "pubmed_rare_disease_db"))
+    parser.add_argument("--method", default=COARSE_METHOD, choices=COARSE_METHODS)
+    parser.add_argument("--dim", type=int, default=COARSE_DIM)
+    parser.add_argument("--sample", type=int, default=FIT_SAMPLE, help="用于学习 PCA 的抽样向量条数")
+    parser.add_argument("--output", default=COARSE_PROJECTION)
+    args = parser.parse_args()
+
+    vectors = np.zeros((0, 0), dtype=np.float32)
+    if args.method == "pca":
+        connections.connect("default", uri=args.uri)
+        collection = Collection(args.collection)
+        collection.load()
+        vectors = sample_vectors(collection, args.sample)
+        print(f"📐 正在用 {len(vectors)} 条抽样向量学习 PCA 投影")
+    fit_projection(vectors, args.method, args.dim).save(args.output)
+    print(f"✅ 粗排投影已写入 {args.output}（{args.method}，{args.dim} 维）")
+    print("💡 已有集合需运行 python migrate_schema.py --coarse 才会生成粗排字段；更换投影后同样需要重新迁移")
@@ -0,0 +1,217 @@
+import os
+import re
+import json
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Sequence
+import numpy as np
+from pymilvus import Collection, CollectionSchema, DataType, FieldSchema, Function, FunctionType
+from dotenv import find_dotenv, load_dotenv
+from coarse_vectors import COARSE_FIELD, COARSE_SCHEMA, load_projection
+from doc_store import DOC_FIELDS, get_doc_store, lean_fields
+from index_profiles import RESCORE_INDEX_PARAMS, VECTOR_FIELD, get_index_params
+from vector_codec import VECTOR_DTYPE, dtype_of, encode_vectors, get_data_type
+
+# ==== 配置 ====
+load_dotenv(find_dotenv(usecwd=True))
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "1024"))
+UNKNOWN_YEAR = 0  # PubDate 只有 MedlineDate 等无法解析的情况
+# 标量索引：INVERTED 同时支持 year 的范围过滤与 journal / source 的 in 过滤（Milvus Lite 也只支持这一种）
+SCALAR_INDEXES = {"year": "INVERTED", "journal": "INVERTED", "source": "INVERTED"}
+# 按年份分区：>= PARTITION_FLOOR 的年份各占一个分区，更早的合并为 y_older，无法解析的进 y_unknown
+PARTITION_FLOOR = int(os.getenv("PARTITION_FLOOR", "2000"))
+PARTITION_OLDER = "y_older"
+PARTITION_UNKNOWN = "y_unknown"
+# BM25 稀疏检索：Milvus 对 title / abstract 分词后自动生成稀疏向量，写入时无需提供
+SPARSE_FIELDS = {"title": "title_sparse", "abstract": "abstract_sparse"}
+OUTPUT_FIELDS = ["pmid", "title", "abstract", "doi", "authors", "journal", "year", "source"]
+INPUT_FIELDS = OUTPUT_FIELDS + [VECTOR_FIELD]  # 各写入脚本传给 write_by_partition 的列顺序
+# 精简 schema：abstract / authors 不进 Milvus（不参与检索，却占查询节点内存），改存本地文档库（doc_store.py）
+# 是否有摘要用 has_abstract 布尔字段表示，供 has_abstract 过滤使用
+LEAN_SCHEMA = os.getenv("LEAN_SCHEMA", "false").lower() == "true"
+
+
+# ==== 集合 schema（setup_milvudb_1.py 与迁移脚本共用） ====
+def build_schema(dim: int = EMBEDDING_DIM, sparse: bool = True, vector_dtype: str = VECTOR_DTYPE,
+                 lean: bool = LEAN_SCHEMA, coarse: bool = COARSE_SCHEMA) -> CollectionSchema:
+    fields = [
+        FieldSchema(name="pmid", dtype=DataType.VARCHAR, is_primary=True, auto_id=False, max_length=32),
+        FieldSchema(name="title", dtype=DataType.VARCHAR, max_length=512, enable_analyzer=sparse),
+        FieldSchema(name="abstract", dtype=DataType.VARCHAR, max_length=15000, enable_analyzer=sparse),
+        FieldSchema(name="doi", dtype=DataType.VARCHAR, max_length=128),
+        FieldSchema(name="authors", dtype=DataType.VARCHAR, max_length=5000),   # 有些文献作者非常多，也需要扩展成max_length = 10000
+        FieldSchema(name="journal", dtype=DataType.VARCHAR, max_length=512),
+        FieldSchema(name="year", dtype=DataType.INT16),                         # 整数年份，可做范围过滤
+        FieldSchema(name="source", dtype=DataType.VARCHAR, max_length=64),
+        FieldSchema(name=VECTOR_FIELD, dtype=get_data_type(vector_dtype), dim=dim)  # float32 / float16 / bfloat16
+    ]
+    if lean:
+        fields = [f for f in fields if f.name not in DOC_FIELDS]
+        fields.insert(-1, FieldSchema(name="has_abstract", dtype=DataType.BOOL))
+    if coarse:
+        # 粗排字段：低维向量常驻内存负责召回；完整向量只在重排时按主键读取，原始数据与 FLAT 索引都内存映射
+        fields[-1] = FieldSchema(name=VECTOR_FIELD, dtype=get_data_type(vector_dtype), dim=dim, mmap_enabled=True)
+        fields.append(FieldSchema(name=COARSE_FIELD, dtype=DataType.FLOAT_VECTOR, dim=load_projection().dim))
+    functions = []
+    if sparse:
+        # 稀疏字段放在最后，按列写入时各脚本的列顺序保持不变；精简 schema 只有 title 的 BM25
+        names = {f.name for f in fields}
+        for text_field, sparse_field in SPARSE_FIELDS.items():
+            if text_field not in names:
+                continue
+            fields.append(FieldSchema(name=sparse_field, dtype=DataType.SPARSE_FLOAT_VECTOR))
+            functions.append(Function(name=f"{text_field}_bm25", function_type=FunctionType.BM25,
+                                      input_field_names=[text_field], output_field_names=[sparse_field]))
+    return CollectionSchema(fields=fields, functions=functions, description="Rare disease literature from PubMed")
+
+
+def create_scalar_indexes(collection: Collection):
+    for field, index_type in SCALAR_INDEXES.items():
+        collection.create_index(field_name=field, index_params={"index_type": index_type}, index_name=f"{field}_idx")
+
+
+def create_sparse_indexes(collection: Collection):
+    for sparse_field in sparse_fields_in(f.name for f in collection.schema.fields):
+        collection.create_index(field_name=sparse_field, index_name=sparse_field,
+                                index_params={"index_type": "SPARSE_INVERTED_INDEX", "metric_type": "BM25"})
+
+
+def create_coarse_index(collection: Collection):
+    # 粗排字段使用与 embedding 相同的索引档位
+    if coarse_dim_of(collection):
+        collection.create_index(field_name=COARSE_FIELD, index_params=get_index_params(), index_name=COARSE_FIELD)
+
+
+def coarse_dim_of(collection: Collection) -> Optional[int]:
+    # 粗排字段的维度；集合没有粗排字段时为 None
+    return next((f.params["dim"] for f in collection.schema.fields if f.name == COARSE_FIELD), None)
+
+
+def vector_index_params(collection: Collection) -> Dict:
+    # 有粗排字段时 INDEX_PROFILE 作用于粗排字段，完整向量只用于重排
+    return RESCORE_INDEX_PARAMS if coarse_dim_of(collection) else get_index_params()
+
+
+def sparse_fields_in(field_names: Iterable[str]) -> List[str]:
+    names = set(field_names)
+    return [f for f in SPARSE_FIELDS.values() if f in names]
+
+
+def is_lean(collection: Collection) -> bool:
+    return bool(lean_fields(f.name for f in collection.schema.fields))
+
+
+def vector_dtype_of(collection: Collection) -> str:
+    return dtype_of(next(f for f in collection.schema.fields if f.name == VECTOR_FIELD).dtype)
+
+
+def create_collection(name: str, dim: int = EMBEDDING_DIM, with_indexes: bool = True,
+                      partitioned: bool = True, sparse: bool = True, vector_dtype: str = VECTOR_DTYPE,
+                      lean: bool = LEAN_SCHEMA, coarse: bool = COARSE_SCHEMA) -> Collection:
+    collection = Collection(name=name, schema=build_schema(dim, sparse=sparse, vector_dtype=vector_dtype, lean=lean,
+                                                           coarse=coarse))
+    if partitioned:
+        collection.create_partition(PARTITION_UNKNOWN)  # 存在年份分区即表示写入时按年份路由
+    if with_indexes:
+        collection.create_index(field_name=VECTOR_FIELD, index_params=vector_index_params(collection),
+                                index_name=VECTOR_FIELD)
+        create_coarse_index(collection)
+        create_scalar_indexes(collection)
+        if sparse:
+            create_sparse_indexes(collection)
+    return collection
+
+
+# ==== 年份：解析器输出的字符串 → INT16 ====
+def parse_year(value) -> int:
+    text = str(value or "").strip()[:4]
+    return int(text) if text.isdigit() else UNKNOWN_YEAR
+
+
+# ==== 年份分区 ====
+def partition_for_year(year: int) -> str:
+    if year == UNKNOWN_YEAR:
+        return PARTITION_UNKNOWN
+    return f"y{year}" if year >= PARTITION_FLOOR else PARTITION_OLDER
+
+
+def is_year_partition(name: str) -> bool:
+    return name in (PARTITION_OLDER, PARTITION_UNKNOWN) or re.fullmatch(r"y\d{4}", name) is not None
+
+
+def is_year_partitioned(partition_names: Iterable[str]) -> bool:
+    return any(is_year_partition(name) for name in partition_names)
+
+
+def partitions_for_range(partition_names: Iterable[str], year_from: Optional[int] = None,
+                         year_to: Optional[int] = None) -> List[str]:
+    # 只挑出与年份范围相交的分区；有年份约束时 y_unknown 不可能命中
+    selected = []
+    for name in partition_names:
+        if name == PARTITION_UNKNOWN:
+            keep = year_from is None and year_to is None
+        elif name == PARTITION_OLDER:
+            keep = year_from is None or year_from < PARTITION_FLOOR
+        elif is_year_partition(name):
+            year = int(name[1:])
+            keep = (year_from is None or year >= year_from) and (year_to is None or year <= year_to)
+        else:
+            keep = year_from is None and year_to is None
+        if keep:
+            selected.append(name)
+    return selected
+
+
+def to_collection_columns(collection: Collection, columns: List[Sequence]) -> List[Sequence]:
+    # 写入方统一按 INPUT_FIELDS 排列各列，这里换算成目标集合的字段（不含 BM25 生成的稀疏字段）
+    by_name = dict(zip(INPUT_FIELDS, columns))
+    names = [f.name for f in collection.schema.fields if not f.is_function_output]
+    if lean_fields(names):
+        # 精简 schema：大文本先写入本地文档库（按 pmid 覆盖），Milvus 只记录是否有摘要
+        get_doc_store().put_many(
+            {"pmid": pmid, **{f: by_name[f][i] for f in DOC_FIELDS}} for i, pmid in enumerate(by_name["pmid"])
+        )
+        by_name["has_abstract"] = [bool(abstract) for abstract in by_name["abstract"]]
+    if COARSE_FIELD in names:
+        # 粗排字段由完整向量投影得到，写入方无需提供
+        by_name[COARSE_FIELD] = load_projection(coarse_dim_of(collection)).project(by_name[VECTOR_FIELD])
+    # 向量列按集合的存储类型编码：float16 / bfloat16 集合每行写入 2 × dim 字节
+    by_name[VECTOR_FIELD] = encode_vectors(by_name[VECTOR_FIELD], vector_dtype_of(collection))
+    return [by_name[name] for name in names]
+
+
+def write_by_partition(collection: Collection, columns: List[Sequence], years: Sequence[int], upsert: bool = False):
+    # columns 按 INPUT_FIELDS 顺序排列；集合没有年份分区时直接整体写入
+    write = collection.upsert if upsert else collection.insert
+    columns = to_collection_columns(collection, columns)
+    existing = {p.name for p in collection.partitions}
+    if not is_year_partitioned(existing):
+        write(columns)
+        return
+    groups = defaultdict(list)
+    for i, year in enumerate(years):
+        groups[partition_for_year(int(year))].append(i)
+    for name, rows in groups.items():
+        if name not in existing:
+            collection.create_partition(name)
+            existing.add(name)
+        subset = [col[rows] if isinstance(col, np.ndarray) else [col[i] for i in rows] for col in columns]
+        write(subset, partition_name=name)
+
+
+# ==== 标量过滤表达式：下推到 client.search 的 filter 参数 ====
+def build_filter_expr(year_from: Optional[int] = None, year_to: Optional[int] = None,
+                      journals: Optional[Sequence[str]] = None, sources: Optional[Sequence[str]] = None,
+                      has_abstract: bool = False, lean: bool = False) -> str:
+    # lean 为 True 表示集合使用精简 schema，摘要不在 Milvus 中，改用 has_abstract 字段过滤
+    clauses: List[str] = []
+    if year_from is not None:
+        clauses.append(f"year >= {int(year_from)}")
+    if year_to is not None:
+        clauses.append(f"year <= {int(year_to)}")
+    if journals:
+        clauses.append(f"journal in {json.dumps(list(journals), ensure_ascii=False)}")
+    if sources:
+        clauses.append(f"source in {json.dumps(list(sources), ensure_ascii=False)}")
+    if has_abstract:
+        clauses.append("has_abstract == true" if lean else 'abstract != ""')
+    return " and ".join(clauses)
@@ -0,0 +1,102 @@
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence
+from dotenv import find_dotenv, load_dotenv
+
+# ==== 配置 ====
+load_dotenv(find_dotenv(usecwd=True))
+# 精简 schema（LEAN_SCHEMA=true）的集合不在 Milvus 中保存这些大文本字段，改存本地文档库
+DOC_STORE_PATH = os.getenv(
+    "DOC_STORE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "doc_store.sqlite")
+)
+DOC_STORE_MMAP_MB = int(os.getenv("DOC_STORE_MMAP_MB", "1024"))  # SQLite 内存映射读取的上限
+DOC_FIELDS = ["abstract", "authors"]
+LOOKUP_BATCH = 500
+
+
+# ==== 本地文档库：SQLite（内存映射读取），按 pmid 批量读写 abstract / authors ====
+class DocStore:
+    def __init__(self, path: str = DOC_STORE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(f"PRAGMA mmap_size={DOC_STORE_MMAP_MB * 1024 * 1024}")
+        self._db.execute(
+            f"CREATE TABLE IF NOT EXISTS doc (pmid TEXT PRIMARY KEY, {', '.join(f + ' TEXT' for f in DOC_FIELDS)})"
+        )
+        self._db.commit()
+        self._lock = threading.Lock()
+
+    def get_many(self, pmids: Sequence[str], fields: Sequence[str] = DOC_FIELDS) -> Dict[str, Dict]:
+        fields = [f for f in fields if f in DOC_FIELDS]
+        found: Dict[str, Dict] = {}
+        if not fields:
+            return found
+        unique = list(dict.fromkeys(pmids))
+        with self._lock:
+            for i in range(0, len(unique), LOOKUP_BATCH):
+                batch = unique[i:i + LOOKUP_BATCH]
+                rows = self._db.execute(
+                    f"SELECT pmid, {', '.join(fields)} FROM doc WHERE pmid IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                for row in rows:
+                    found[row[0]] = dict(zip(fields, row[1:]))
+        return found
+
+    def put_many(self, docs: Iterable[Dict]):
+        rows = [(doc["pmid"], *(doc.get(f) or "" for f in DOC_FIELDS)) for doc in docs]
+        if not rows:
+            return
+        with self._lock:
+            self._db.executemany(
+                f"INSERT OR REPLACE INTO doc VALUES (?, {', '.join('?' * len(DOC_FIELDS))})", rows
+            )
+            self._db.commit()
+
+    def delete_many(self, pmids: Sequence[str]):
+        with self._lock:
+            for i in range(0, len(pmids), LOOKUP_BATCH):
+                batch = list(pmids[i:i + LOOKUP_BATCH])
+                self._db.execute(f"DELETE FROM doc WHERE pmid IN ({','.join('?' * len(batch))})", batch)
+            self._db.commit()
+
+    def count(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM doc").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_default_store: Optional[DocStore] = None
+
+
+def get_doc_store() -> DocStore:
+    global _default_store
+    if not DOC_STORE_PATH:
+        raise RuntimeError("集合使用精简 schema（abstract / authors 不在 Milvus 中），需要配置 DOC_STORE_PATH")
+    if _default_store is None:
+        _default_store = DocStore(DOC_STORE_PATH)
+    return _default_store
+
+
+def hydrate_rows(rows: Dict[str, Dict], pmids: Sequence[str], fields: Sequence[str]) -> Dict[str, Dict]:
+    # 把文档库中的字段合并进按 pmid 索引的行；文档库缺失的记录补空字符串
+    fields = [f for f in fields if f in DOC_FIELDS]
+    if not fields:
+        return rows
+    docs = get_doc_store().get_many(pmids, fields)
+    for pmid in dict.fromkeys(pmids):
+        doc = docs.get(pmid, {})
+        rows.setdefault(pmid, {"pmid": pmid}).update({f: doc.get(f, "") for f in fields})
+    return rows
+
+
+def lean_fields(field_names: Iterable[str]) -> List[str]:
+    # 集合 schema 中缺少、需要从文档库读取的字段
+    names = set(field_names)
+    return [f for f in DOC_FIELDS if f not in names]
@@ -1,40 +1,55 @@
 import os
+import sys
 import json
-import time
-import requests
-from typing import List
+import asyncio
+import argparse
+from typing import Dict, List, Optional
+from tqdm import tqdm
 from dotenv import load_dotenv
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # 复用仓库根目录的共享模块
+from embedding_client import AsyncEmbeddingClient, EmbeddingClient, iter_batches
+from embedding_store import get_embedding_store
+from vector_codec import sidecar_dtype
+from vector_sidecar import sidecar_exists, write_sidecar
+
 
 # ==== 配置 ====
 load_dotenv()
-EMBEDDING_API_URL = os.getenv("EMBEDDING_API_URL")
-EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL")
-EMBEDDING_DIM = 1024
-
 INPUT_FOLDER = "json_batches"
 OUTPUT_FOLDER = "json_embedded"
-SLEEP_INTERVAL = 0.5  # 可调
-
-# === 向量化函数 ===
-def get_embedding(text: str) -> List[float]:
-    payload = {
-        "input": [text],
-        "model": EMBEDDING_MODEL
-    }
-    try:
-        response = requests.post(EMBEDDING_API_URL, json=payload)
-        response.raise_for_status()
-        embedding = response.json()["data"][0]["embedding"]
-        if len(embedding) != EMBEDDING_DIM:
-            raise ValueError(f"Embedding dim mismatch: got {len(embedding)}, expected {EMBEDDING_DIM}")
-        return embedding
-    except Exception as e:
-        print(f"❌ 向量化失败: {e}")
-        return []
+CHECKPOINT_FOLDER = "json_embedded_checkpoints"   # 每条记录完成即追加写入，用于断点续跑
+CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "8"))  # 同时在途的请求数
+# npy: 元数据 JSONL + float32 .npy（默认，体积小、入库快）；json: 旧版可读格式
+OUTPUT_FORMAT = os.getenv("EMBEDDING_OUTPUT_FORMAT", "npy")
+# 单条记录在多少次运行中都向量化失败后放弃，不再阻塞整个文件的输出
+RECORD_MAX_ATTEMPTS = int(os.getenv("EMBEDDING_RECORD_ATTEMPTS", "3"))
+
+
+def record_text(record: Dict) -> str:
+    return f"{record.get('title', '')} {record.get('abstract', '')}".strip()
+
+
+def output_base(fname: str) -> str:
+    return os.path.join(OUTPUT_FOLDER, os.path.splitext(fname)[0])
+
+
+def output_exists(fname: str) -> bool:
+    if OUTPUT_FORMAT == "json":
+        return os.path.exists(os.path.join(OUTPUT_FOLDER, fname))
+    return sidecar_exists(output_base(fname))
+
+
+def write_output(fname: str, records: List[Dict]):
+    if OUTPUT_FORMAT == "json":
+        with open(os.path.join(OUTPUT_FOLDER, fname), "w", encoding="utf-8") as f:
+            json.dump(records, f, ensure_ascii=False, indent=2)
+    else:
+        write_sidecar(output_base(fname), records, [r["embedding"] for r in records], dtype=sidecar_dtype())
+
 
 # === 处理单个JSON文件 ===
-def process_json_file(input_path: str, output_path: str):
+def process_json_file(input_path: str, fname: str, client: EmbeddingClient):
     try:
         with open(input_path, "r", encoding="utf-8") as f:
             records = json.load(f)
@@ -42,38 +57,185 @@ def process_json_file(input_path: str, output_path: str):
         print(f"❌ 读取失败: {input_path}, 错误: {e}")
         return
 
-    new_records = []
-    for record in records:
-        try:
-            combined = f"{record.get('title', '')} {record.get('abstract', '')}".strip()
-            embedding = get_embedding(combined)
-            if not embedding:
-                continue
-            record["embedding"] = embedding
-            new_records.append(record)
-            # time.sleep(SLEEP_INTERVAL)
-        except Exception as e:
-            print(f"⚠️ 单条失败: {e}")
-            continue
+    job = FileJob(fname, records)
+    if job.pending:
+        texts = [record_text(records[i]) for i in job.pending]
+        job.add(job.pending, client.embed(texts, raise_on_error=False))  # 按批打包请求，失败的条目为 None
 
     try:
-        with open(output_path, "w", encoding="utf-8") as f:
-            json.dump(new_records, f, ensure_ascii=False, indent=2)
-        print(f"✅ 已处理: {input_path} → {output_path}, 共 {len(new_records)} 条")
+        job.finalize()
     except Exception as e:
-        print(f"❌ 写入失败: {output_path}, 错误: {e}")
+        print(f"❌ 写入失败: {output_base(fname)}, 错误: {e}")
 
 # === 遍历所有文件 ===
 def process_all_files():
     os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+    os.makedirs(CHECKPOINT_FOLDER, exist_ok=True)
     files = sorted(f for f in os.listdir(INPUT_FOLDER) if f.endswith(".json"))
     print(f"📁 待处理文件数: {len(files)}")
 
+    client = EmbeddingClient(store=get_embedding_store())  # 先查内容哈希向量库
     for fname in files:
         in_path = os.path.join(INPUT_FOLDER, fname)
-        out_path = os.path.join(OUTPUT_FOLDER, fname)
-        process_json_file(in_path, out_path)
+        if output_exists(fname):
+            continue  # 避免重复处理
+        process_json_file(in_path, fname, client)
+    report_store()
+
+
+def report_store():
+    store = get_embedding_store()
+    if store is not None:
+        print(store.report())
+
+
+# === 单个文件的进度：checkpoint 记录已完成的记录下标与向量，以及失败过的记录 ===
+class FileJob:
+    def __init__(self, fname: str, records: List[Dict]):
+        self.fname = fname
+        self.records = records
+        self.checkpoint_path = os.path.join(CHECKPOINT_FOLDER, fname + "l")  # xxx.json -> xxx.jsonl
+        self.failures: Dict[int, int] = {}  # 记录下标 -> 之前运行中失败的次数
+        self.embeddings: Dict[int, List[float]] = self._load_checkpoint()
+        self.given_up = {i for i, n in self.failures.items()
+                         if n >= RECORD_MAX_ATTEMPTS and i not in self.embeddings}
+        self.pending = [i for i in range(len(records)) if i not in self.embeddings and i not in self.given_up]
+        self.remaining = len(self.pending)
+        self.failed = 0  # 本次运行失败的条数
+        self._checkpoint = None
+
+    def _load_checkpoint(self) -> Dict[int, List[float]]:
+        done = {}
+        if not os.path.exists(self.checkpoint_path):
+            return done
+        with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    item = json.loads(line)
+                    if item.get("failed"):
+                        self.failures[item["idx"]] = self.failures.get(item["idx"], 0) + 1
+                    else:
+                        done[item["idx"]] = item["embedding"]
+                except (json.JSONDecodeError, KeyError):
+                    continue  # 中断时写了一半的行，重新向量化即可
+        return done
+
+    def add(self, indices: List[int], embeddings: List[Optional[List[float]]]):
+        if self._checkpoint is None:
+            self._checkpoint = open(self.checkpoint_path, "a", encoding="utf-8")
+        for idx, embedding in zip(indices, embeddings):
+            if embedding is None:
+                print(f"⚠️ 单条失败: {self.records[idx].get('pmid', 'unknown')}")
+                self._checkpoint.write(json.dumps({"idx": idx, "failed": True}) + "\n")
+                self.failed += 1
+                continue
+            self.embeddings[idx] = embedding
+            self._checkpoint.write(json.dumps({"idx": idx, "embedding": embedding}) + "\n")
+        self._checkpoint.flush()
+        self.remaining -= len(indices)
+
+    def finalize(self):
+        if self._checkpoint is not None:
+            self._checkpoint.close()
+        if self.failed:
+            # 有记录失败：不写输出、保留 checkpoint，下次运行只重试缺失的记录
+            print(f"⚠️ {self.fname}: {self.failed} 条向量化失败，已保留断点，下次运行重试")
+            return
+        if self.given_up:
+            print(f"⚠️ {self.fname}: 放弃 {len(self.given_up)} 条 {RECORD_MAX_ATTEMPTS} 次运行都失败的记录")
+        new_records = []
+        for idx, record in enumerate(self.records):
+            if idx in self.embeddings:
+                record["embedding"] = self.embeddings[idx]
+                new_records.append(record)
+        write_output(self.fname, new_records)
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        print(f"✅ 已处理: {self.fname}, 共 {len(new_records)} 条")
+
+
+# === 并发模式：有界队列 + 固定数量的 worker，保持 concurrency 个请求在途 ===
+async def process_all_files_concurrent(concurrency: int = CONCURRENCY):
+    os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+    os.makedirs(CHECKPOINT_FOLDER, exist_ok=True)
+    files = sorted(
+        f for f in os.listdir(INPUT_FOLDER)
+        if f.endswith(".json") and not output_exists(f)
+    )
+    print(f"📁 待处理文件数: {len(files)}，并发数: {concurrency}")
+
+    client = AsyncEmbeddingClient(pool_size=concurrency, store=get_embedding_store())  # 先查内容哈希向量库
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)  # 队列满时生产者等待（背压）
+    progress = tqdm(desc="🧠 正在向量化", unit="篇")
+
+    errors: List[BaseException] = []  # worker 的异常交给生产者抛出
+
+    async def worker():
+        while True:
+            item = await queue.get()
+            try:
+                if item is None:
+                    return
+                if errors:
+                    continue  # 已有 worker 出错：只清空队列，避免生产者阻塞在满队列上
+                job, indices = item
+                embeddings = await client.embed([record_text(job.records[i]) for i in indices], raise_on_error=False)
+                job.add(indices, embeddings)
+                progress.update(len(indices))
+                if job.remaining == 0:
+                    job.finalize()
+            except Exception as e:
+                print(f"❌ 批次失败，停止向量化: {job.fname}, 错误: {e}")
+                errors.append(e)
+            finally:
+                queue.task_done()
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        for fname in files:
+            if errors:
+                break
+            try:
+                with open(os.path.join(INPUT_FOLDER, fname), "r", encoding="utf-8") as f:
+                    records = json.load(f)
+            except Exception as e:
+                print(f"❌ 读取失败: {fname}, 错误: {e}")
+                continue
+
+            job = FileJob(fname, records)
+            if job.embeddings:
+                print(f"↩️ 从断点继续: {fname}，已完成 {len(job.embeddings)} 条")
+            if job.remaining == 0:
+                job.finalize()
+                continue
+            texts = [record_text(records[i]) for i in job.pending]
+            for batch in iter_batches(texts, client.batch_size, client.max_batch_tokens):
+                if errors:
+                    break
+                await queue.put((job, [job.pending[i] for i in batch]))
+
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+        if errors:
+            raise errors[0]  # 未完成的文件保留 checkpoint，下次运行继续
+    finally:
+        progress.close()
+        await client.aclose()
+    report_store()
+
 
 # === 执行入口 ===
 if __name__ == "__main__":
-    process_all_files()
+    parser = argparse.ArgumentParser(description="Stage 4: 为 json_batches 生成向量")
+    parser.add_argument("--sequential", action="store_true", help="逐文件顺序处理（不使用并发）")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="同时在途的 embedding 请求数")
+    parser.add_argument("--format", choices=["npy", "json"], default=OUTPUT_FORMAT,
+                        help="输出格式：npy（JSONL + float32 .npy）或 json（旧版可读格式）")
+    args = parser.parse_args()
+    OUTPUT_FORMAT = args.format
+
+    if args.sequential:
+        process_all_files()
+    else:
+        asyncio.run(process_all_files_concurrent(args.concurrency))
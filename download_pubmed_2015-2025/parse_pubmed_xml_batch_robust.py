@@ -1,11 +1,21 @@
 import os
+import gzip
 import json
+import argparse
 import xml.etree.ElementTree as ET
+from multiprocessing import Pool
+from typing import IO, Any, Iterable, Iterator, List, Optional, Tuple
 from tqdm import tqdm
 
 INPUT_FOLDER = "xml_batches"
 OUTPUT_FOLDER = "json_batches"
-os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", str(os.cpu_count() or 1)))  # 并行解析的进程数
+# 本地 PubMed 镜像（baseline/ 与 updatefiles/ 下的 pubmedXXnXXXX.xml.gz）
+PUBMED_MIRROR = os.getenv("PUBMED_MIRROR", "pubmed_mirror")
+# 镜像模式下的默认筛选条件，多个值用 ; 分隔
+FILTER_KEYWORDS = os.getenv("FILTER_KEYWORDS", "rare disease")
+FILTER_MESH = os.getenv("FILTER_MESH", "Rare Diseases")
+DELETED_SUFFIX = ".deleted.txt"
 
 
 def parse_article(article) -> dict:
@@ -55,39 +65,169 @@ def parse_article(article) -> dict:
         return None
 
 
-def process_batch_file_safe(file_path: str, output_path: str):
-    results = []
+# 解析过程中按关键词 / MeSH / 年份筛选文章
+class ArticleFilter:
+    def __init__(self, keywords: Iterable[str] = (), mesh_terms: Iterable[str] = (),
+                 min_year: Optional[int] = None, max_year: Optional[int] = None):
+        self.keywords = [k.strip().lower() for k in keywords if k.strip()]
+        self.mesh_terms = {m.strip().lower() for m in mesh_terms if m.strip()}
+        self.min_year = min_year
+        self.max_year = max_year
+
+    def __call__(self, article, record: dict) -> bool:
+        if self.min_year is not None or self.max_year is not None:
+            year = int(record["year"]) if record["year"].isdigit() else None
+            if year is None:
+                return False
+            if (self.min_year is not None and year < self.min_year) or (self.max_year is not None and year > self.max_year):
+                return False
+
+        if not self.keywords and not self.mesh_terms:
+            return True
+        text = f"{record['title']} {record['abstract']}".lower()
+        if any(k in text for k in self.keywords):
+            return True
+        for keyword in article.iterfind("MedlineCitation/KeywordList/Keyword"):
+            if any(k in (keyword.text or "").lower() for k in self.keywords):
+                return True
+        for descriptor in article.iterfind("MedlineCitation/MeshHeadingList/MeshHeading/DescriptorName"):
+            if (descriptor.text or "").lower() in self.mesh_terms:
+                return True
+        return False
+
+
+def open_xml(file_path: str) -> IO[bytes]:
+    # .xml.gz 直接从 gzip 流解析，不解压到磁盘
+    return gzip.open(file_path, "rb") if file_path.endswith(".gz") else open(file_path, "rb")
+
+
+# 流式解析单个文件：逐条产出 ("article", 记录) 或 ("delete", [PMID, ...])
+def iter_pubmed_file(file_path: str, article_filter: Optional[ArticleFilter] = None) -> Iterator[Tuple[str, Any]]:
     try:
-        context = ET.iterparse(file_path, events=("end",))
-        for event, elem in context:
-            if elem.tag == "PubmedArticle":
-                parsed = parse_article(elem)
-                if parsed:
-                    results.append(parsed)
-                elem.clear()  # 节省内存
+        with open_xml(file_path) as source:
+            for event, elem in ET.iterparse(source, events=("end",)):
+                if elem.tag == "PubmedArticle":
+                    parsed = parse_article(elem)
+                    if parsed and (article_filter is None or article_filter(elem, parsed)):
+                        yield "article", parsed
+                    elem.clear()  # 节省内存
+                elif elem.tag == "DeleteCitation":
+                    # updatefiles 中被撤回的文献，交给 Stage 5 从 Milvus 删除
+                    yield "delete", [p.text for p in elem.findall("PMID") if p.text]
+                    elem.clear()
     except ET.ParseError as e:
+        if file_path.endswith(".gz"):
+            raise  # 镜像文件本身是完整的 XML，解析出错说明下载被截断，交给调用方重试
         print(f"⚠️ 文件部分解析失败: {file_path} - {e}")
 
-    if results:
+
+def process_batch_file_safe(file_path: str, output_path: str, verbose: bool = True,
+                            article_filter: Optional[ArticleFilter] = None) -> int:
+    results = []
+    deleted = []
+    try:
+        for kind, item in iter_pubmed_file(file_path, article_filter):
+            if kind == "article":
+                results.append(item)
+            else:
+                deleted.extend(item)
+    except (ET.ParseError, OSError, EOFError) as e:
+        # 文件损坏或被截断（.gz 读取失败）：不写出任何结果，下次运行时重新解析
+        print(f"❌ 文件读取失败，已跳过（下次运行会重试）: {file_path} - {e}")
+        return 0
+
+    if deleted:
+        with open(output_path.replace(".json", DELETED_SUFFIX), "w", encoding="utf-8") as f:
+            f.write("\n".join(deleted) + "\n")
+
+    # 镜像文件即使没有命中也写出空列表，保证断点续跑时可跳过
+    if results or file_path.endswith(".gz"):
         with open(output_path, "w", encoding="utf-8") as f:
             json.dump(results, f, indent=2, ensure_ascii=False)
-        print(f"✅ 完成解析 {file_path}，成功提取 {len(results)} 篇")
-    else:
-        print(f"🚫 无有效文章提取于 {file_path}")
+    if verbose:
+        if results:
+            print(f"✅ 完成解析 {file_path}，成功提取 {len(results)} 篇")
+        else:
+            print(f"🚫 无有效文章提取于 {file_path}")
+    return len(results)
+
+
+def _parse_worker(task: Tuple[str, str, Optional[ArticleFilter]]) -> Tuple[str, int]:
+    input_path, output_path, article_filter = task
+    return input_path, process_batch_file_safe(input_path, output_path, verbose=False, article_filter=article_filter)
 
 
-def process_all_batches():
-    xml_files = sorted(f for f in os.listdir(INPUT_FOLDER) if f.endswith(".xml"))
+def list_mirror_files(mirror: str) -> List[str]:
+    # baseline 先于 updatefiles；两者编号连续，按文件名排序即按发布顺序
+    files = []
+    for folder in (mirror, os.path.join(mirror, "baseline"), os.path.join(mirror, "updatefiles")):
+        if os.path.isdir(folder):
+            files.extend(os.path.join(folder, f) for f in os.listdir(folder) if f.endswith(".xml.gz"))
+    return sorted(files, key=os.path.basename)
 
-    for file in tqdm(xml_files, desc="📦 正在解析 XML 批次"):
-        input_path = os.path.join(INPUT_FOLDER, file)
-        output_path = os.path.join(OUTPUT_FOLDER, file.replace(".xml", ".json"))
+
+def list_sources(mirror: Optional[str] = None) -> List[str]:
+    if mirror:
+        return list_mirror_files(mirror)
+    return sorted(os.path.join(INPUT_FOLDER, f) for f in os.listdir(INPUT_FOLDER) if f.endswith(".xml"))
+
+
+def process_all_batches(workers: int = 1, mirror: Optional[str] = None,
+                        article_filter: Optional[ArticleFilter] = None):
+    os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+    sources = list_sources(mirror)
+
+    tasks = []
+    for input_path in sources:
+        name = os.path.basename(input_path).replace(".xml.gz", ".xml")
+        output_path = os.path.join(OUTPUT_FOLDER, name.replace(".xml", ".json"))
 
         if os.path.exists(output_path):
             continue  # 避免重复处理
-
-        process_batch_file_safe(input_path, output_path)
+        tasks.append((input_path, output_path, article_filter))
+
+    if workers <= 1:
+        for input_path, output_path, _ in tqdm(tasks, desc="📦 正在解析 XML 批次"):
+            process_batch_file_safe(input_path, output_path, article_filter=article_filter)
+        return
+
+    # 多进程：每个进程负责整文件（仍是 iterparse + elem.clear()），imap 按文件顺序返回结果
+    total_articles = 0
+    with Pool(processes=workers) as pool, tqdm(total=len(tasks), desc=f"📦 正在解析 XML 批次 ({workers} 进程)") as bar:
+        for input_path, count in pool.imap(_parse_worker, tasks, chunksize=1):
+            total_articles += count
+            if count == 0:
+                tqdm.write(f"🚫 无有效文章提取于 {input_path}")
+            bar.update(1)
+            bar.set_postfix(articles=total_articles)
+    print(f"✅ 完成解析 {len(tasks)} 个批次，共提取 {total_articles} 篇")
+
+
+def add_source_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--mirror", nargs="?", const=PUBMED_MIRROR, default=None,
+                        help="直接解析本地 PubMed baseline/updatefiles 镜像（默认目录 PUBMED_MIRROR）")
+    parser.add_argument("--keyword", action="append", help="标题/摘要/关键词包含该词即保留，可重复")
+    parser.add_argument("--mesh", action="append", help="MeSH 主题词命中即保留，可重复")
+    parser.add_argument("--min-year", type=int, default=None)
+    parser.add_argument("--max-year", type=int, default=None)
+    parser.add_argument("--no-filter", action="store_true", help="保留全部文章")
+
+
+def build_filter(args: argparse.Namespace) -> Optional[ArticleFilter]:
+    if args.no_filter:
+        return None
+    keywords, mesh_terms = args.keyword or [], args.mesh or []
+    if args.mirror and not keywords and not mesh_terms:
+        # 镜像模式未指定条件时，使用 FILTER_KEYWORDS / FILTER_MESH
+        keywords, mesh_terms = FILTER_KEYWORDS.split(";"), FILTER_MESH.split(";")
+    if keywords or mesh_terms or args.min_year or args.max_year:
+        return ArticleFilter(keywords, mesh_terms, args.min_year, args.max_year)
+    return None
 
 
 if __name__ == "__main__":
-    process_all_batches()
+    parser = argparse.ArgumentParser(description="Stage 3: 将 xml_batches（或 PubMed 镜像 .xml.gz）解析为 json_batches")
+    parser.add_argument("--workers", type=int, default=PARSE_WORKERS, help="并行解析的进程数（1 为单进程）")
+    add_source_arguments(parser)
+    args = parser.parse_args()
+    process_all_batches(workers=args.workers, mirror=args.mirror, article_filter=build_filter(args))
@@ -1,22 +1,37 @@
 import os
+import sys
 import json
+import argparse
+from typing import Dict, List, Sequence, Set, Tuple
+import numpy as np
 from pymilvus import connections, Collection
 from tqdm import tqdm
 from dotenv import load_dotenv
 
-# 配置 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # 复用仓库根目录的共享模块
+from collection_schema import is_lean, parse_year, write_by_partition
+from doc_store import get_doc_store
+from index_profiles import build_vector_index, drop_vector_index, get_index_params
+from query_cache import bump_collection_generation
+from vector_sidecar import VECTOR_SUFFIX, iter_sidecar_chunks
+
+# 配置
 load_dotenv()
 COLLECTION_NAME = os.getenv("COLLECTION_NAME")
 EMBEDDED_JSON_FOLDER = "json_embedded"
+INSERT_CHUNK_SIZE = 1000  # .npy 格式按块流式写入
+INSERT_CHUNK_MB = float(os.getenv("INSERT_CHUNK_MB", "48"))  # 单次 insert 的数据量上限（需小于 gRPC 64MB 限制）
+REQUIRED_FIELDS = ["pmid", "title", "abstract", "doi", "authors", "journal", "year", "source"]
+DELETIONS_FOLDER = "json_batches"  # Stage 3 解析 updatefiles 时在此写出 *.deleted.txt
+DELETED_SUFFIX = ".deleted.txt"
+DELETIONS_LEDGER = os.path.join(DELETIONS_FOLDER, "deletions_applied.txt")  # 已执行删除的 *.deleted.txt
+DELETE_CHUNK_SIZE = 1000
 
-# ✅ 连接 Milvus
-connections.connect("default", host="localhost", port="19530")
-collection = Collection(COLLECTION_NAME)
-collection.load()
 
-def insert_to_milvus(docs):
+def insert_to_milvus(collection: Collection, docs: List[Dict], vectors: Sequence, flush: bool = True):
     if not docs:
         return
+    years = [parse_year(doc["year"]) for doc in docs]
     entities = [
         [doc["pmid"] for doc in docs],
         [doc["title"] for doc in docs],
@@ -24,47 +39,187 @@ def insert_to_milvus(docs):
         [doc["doi"] for doc in docs],
         [doc["authors"] for doc in docs],
         [doc["journal"] for doc in docs],
-        [doc["year"] for doc in docs],
+        years,
         [doc["source"] for doc in docs],
-        [doc["embedding"] for doc in docs],
+        vectors,
     ]
-    collection.insert(entities)
-    collection.flush()
+    write_by_partition(collection, entities, years)  # 年份分区的集合按年份路由
+    if flush:
+        collection.flush()
+        bump_collection_generation(COLLECTION_NAME)  # 使 MCP Server 的检索结果缓存失效
+
+
+def estimate_row_bytes(doc: Dict) -> int:
+    return sum(len(str(doc[k]).encode("utf-8")) for k in REQUIRED_FIELDS)
+
+
+# ✅ 跨文件攒批：按数据量切块 insert，commit() 时才 flush
+class ChunkedInserter:
+    def __init__(self, collection: Collection, chunk_mb: float = INSERT_CHUNK_MB):
+        self.collection = collection
+        self.chunk_bytes = int(chunk_mb * 1024 * 1024)
+        self.total = 0
+        self._docs: List[Dict] = []
+        self._vectors: List[np.ndarray] = []
+        self._bytes = 0
+
+    def add(self, docs: List[Dict], vectors: Sequence):
+        if not docs:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)
+        self._docs.extend(docs)
+        self._vectors.append(vectors)
+        self._bytes += sum(estimate_row_bytes(doc) for doc in docs) + vectors.nbytes
+        if self._bytes >= self.chunk_bytes:
+            self._insert_buffered()
+
+    def _insert_buffered(self):
+        if self._docs:
+            insert_to_milvus(self.collection, self._docs, np.concatenate(self._vectors), flush=False)
+            self.total += len(self._docs)
+        self._docs, self._vectors, self._bytes = [], [], 0
 
-# ✅ 遍历所有 JSON 文件
-for filename in tqdm(sorted(os.listdir(EMBEDDED_JSON_FOLDER))):
-    if not filename.endswith(".json"):
-        continue
+    def commit(self):
+        self._insert_buffered()
+        self.collection.flush()
+        bump_collection_generation(COLLECTION_NAME)  # 使 MCP Server 的检索结果缓存失效
+
+
+# ✅ 旧版 JSON 格式（embedding 为 JSON 浮点列表）
+def store_json_file(inserter: ChunkedInserter, filename: str):
     file_path = os.path.join(EMBEDDED_JSON_FOLDER, filename)
-    try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-
-        if isinstance(data, dict):
-            data = [data]
-        elif not isinstance(data, list):
-            print(f"⚠️ 文件格式错误：{filename}")
+    with open(file_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    if isinstance(data, dict):
+        data = [data]
+    elif not isinstance(data, list):
+        print(f"⚠️ 文件格式错误：{filename}")
+        return
+
+    valid_docs = []
+    for item in data:
+        try:
+            # 检查是否包含所有字段
+            if all(k in item for k in REQUIRED_FIELDS + ["embedding"]):
+                valid_docs.append(item)
+            else:
+                print(f"⚠️ 缺字段: {item.get('pmid', 'unknown')} in {filename}")
+        except Exception as e:
+            print(f"⚠️ 解析失败: {e}")
             continue
 
-        valid_docs = []
-        for item in data:
-            try:
-                # 检查是否包含所有字段
-                required_fields = ["pmid", "title", "abstract", "doi", "authors",
-                                   "journal", "year", "source", "embedding"]
-                if all(k in item for k in required_fields):
-                    valid_docs.append(item)
-                else:
-                    print(f"⚠️ 缺字段: {item.get('pmid', 'unknown')} in {filename}")
-            except Exception as e:
-                print(f"⚠️ 解析失败: {e}")
+    if valid_docs:
+        inserter.add(valid_docs, [doc["embedding"] for doc in valid_docs])
+        print(f"✅ 已导入文件: {filename} 共 {len(valid_docs)} 条记录")
+    else:
+        print(f"⚠️ 无有效记录: {filename}")
+
+
+# ✅ 紧凑格式：元数据 JSONL + 内存映射的 float32 .npy，按块流式写入
+def store_sidecar_file(inserter: ChunkedInserter, filename: str):
+    base_path = os.path.join(EMBEDDED_JSON_FOLDER, filename[:-len(VECTOR_SUFFIX)])
+    total = 0
+    for docs, vectors in iter_sidecar_chunks(base_path, INSERT_CHUNK_SIZE):
+        missing = [doc.get("pmid", "unknown") for doc in docs if not all(k in doc for k in REQUIRED_FIELDS)]
+        if missing:
+            print(f"⚠️ 缺字段: {missing} in {filename}")
+            keep = [i for i, doc in enumerate(docs) if all(k in doc for k in REQUIRED_FIELDS)]
+            docs, vectors = [docs[i] for i in keep], vectors[keep]
+        inserter.add(docs, vectors)
+        total += len(docs)
+    print(f"✅ 已导入文件: {filename} 共 {total} 条记录")
+
+
+def delete_pmids(collection: Collection, pmids: List[str]):
+    for start in range(0, len(pmids), DELETE_CHUNK_SIZE):
+        collection.delete(expr=f"pmid in {json.dumps(pmids[start:start + DELETE_CHUNK_SIZE])}")
+    if is_lean(collection):
+        get_doc_store().delete_many(pmids)  # 精简 schema：同时删除本地文档库中的正文
+
+
+def load_applied_deletions() -> Set[str]:
+    if not os.path.exists(DELETIONS_LEDGER):
+        return set()
+    with open(DELETIONS_LEDGER, "r", encoding="utf-8") as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+def record_applied_deletion(filename: str):
+    with open(DELETIONS_LEDGER, "a", encoding="utf-8") as f:
+        f.write(filename + "\n")
+
+
+# ✅ 删除 PubMed 已撤回（DeleteCitation）的文献
+def apply_deletions(collection: Collection, filename: str):
+    with open(os.path.join(DELETIONS_FOLDER, filename), "r", encoding="utf-8") as f:
+        pmids = [line.strip() for line in f if line.strip()]
+    delete_pmids(collection, pmids)
+    collection.flush()
+    bump_collection_generation(COLLECTION_NAME)
+    record_applied_deletion(filename)
+    print(f"🗑️ 已删除撤回文献: {filename} 共 {len(pmids)} 条")
+
+
+# ✅ 写入与删除按文件发布顺序交替执行：pubmedXXnYYYY 的删除在它自身的写入之后、下一个文件的写入之前
+# 同名文件先写入再删除；返回 (文件名主干, 0 写入 / 1 删除, 文件名) 的有序列表
+def plan_files() -> List[Tuple[str, int, str]]:
+    plan = []
+    for filename in os.listdir(EMBEDDED_JSON_FOLDER):
+        if filename.endswith(VECTOR_SUFFIX) or filename.endswith(".json"):
+            plan.append((os.path.splitext(filename)[0], 0, filename))
+    if os.path.isdir(DELETIONS_FOLDER):
+        for filename in os.listdir(DELETIONS_FOLDER):
+            if filename.endswith(DELETED_SUFFIX):
+                plan.append((filename[:-len(DELETED_SUFFIX)], 1, filename))
+    return sorted(plan)
+
+
+def main(bulk: bool = False, rebuild_index: bool = False, chunk_mb: float = INSERT_CHUNK_MB):
+    # ✅ 连接 Milvus
+    connections.connect("default", host="localhost", port="19530")
+    collection = Collection(COLLECTION_NAME)
+    index_params = None
+    if rebuild_index:
+        # 批量导入前删除向量索引，导入后重建，使 IVF 聚类中心基于真实数据训练
+        # 集合还没有向量索引时，按 INDEX_PROFILE 配置的档位创建
+        index_params = drop_vector_index(collection) or get_index_params()
+    else:
+        collection.load()
+
+    # ✅ 遍历所有 JSON / .npy 文件；bulk 模式下跨文件攒大块，只在最后 flush 一次
+    inserter = ChunkedInserter(collection, chunk_mb)
+    applied = load_applied_deletions()
+    inserted = False
+    for _, kind, filename in tqdm(plan_files()):
+        try:
+            if kind == 1:
+                # 已执行过的删除只在本次重新写入了更早的文件时才需要再执行
+                if filename in applied and not inserted:
+                    continue
+                inserter.commit()  # 先把之前文件的写入落盘，删除才能作用于它们
+                apply_deletions(collection, filename)
                 continue
+            if filename.endswith(VECTOR_SUFFIX):
+                store_sidecar_file(inserter, filename)
+            else:
+                store_json_file(inserter, filename)
+            inserted = True
+            if not bulk:
+                inserter.commit()
+        except Exception as e:
+            print(f"❌ 文件处理失败: {filename}, 错误: {e}")
+    inserter.commit()
+    print(f"📦 共写入 {inserter.total} 条记录")
+
+    if rebuild_index:
+        build_vector_index(collection, index_params)
 
-        if valid_docs:
-            insert_to_milvus(valid_docs)
-            print(f"✅ 已导入文件: {filename} 共 {len(valid_docs)} 条记录")
-        else:
-            print(f"⚠️ 无有效记录: {filename}")
 
-    except Exception as e:
-        print(f"❌ 文件处理失败: {filename}, 错误: {e}")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stage 5: 将 json_embedded 写入 Milvus")
+    parser.add_argument("--bulk", action="store_true", help="批量导入：按数据量攒大块 insert，最后只 flush 一次")
+    parser.add_argument("--rebuild-index", action="store_true", help="导入前删除向量索引，导入后基于真实数据重建")
+    parser.add_argument("--chunk-mb", type=float, default=INSERT_CHUNK_MB, help="单次 insert 的数据量上限 (MB)")
+    args = parser.parse_args()
+    main(bulk=args.bulk, rebuild_index=args.rebuild_index, chunk_mb=args.chunk_mb)
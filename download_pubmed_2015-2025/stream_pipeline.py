@@ -0,0 +1,258 @@
+import os
+import sys
+import time
+import queue
+import argparse
+import threading
+from typing import Any, Dict, List, Optional
+import numpy as np
+from pymilvus import connections, Collection
+from dotenv import load_dotenv
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # 复用仓库根目录的共享模块
+from embedding_client import EMBEDDING_BATCH_SIZE, EmbeddingClient, EmbeddingUnavailableError
+from embedding_store import get_embedding_store
+from query_cache import bump_collection_generation
+from parse_pubmed_xml_batch_robust import ArticleFilter, add_source_arguments, build_filter, iter_pubmed_file, list_sources
+from store_jsons_to_milvus import COLLECTION_NAME, INSERT_CHUNK_SIZE, REQUIRED_FIELDS, delete_pmids, insert_to_milvus
+
+# ==== 配置 ====
+load_dotenv()
+CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "8"))  # 同时在途的 embedding 请求数
+QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "16"))     # 各阶段之间缓冲的批次数
+REPORT_INTERVAL = 10.0  # 秒
+_DONE = object()
+
+
+# ==== 各阶段吞吐统计 ====
+class StageStats:
+    def __init__(self, name: str):
+        self.name = name
+        self.count = 0
+        self.busy = 0.0  # 实际工作耗时（不含等待上下游）
+        self._lock = threading.Lock()
+
+    def add(self, count: int, seconds: float):
+        with self._lock:
+            self.count += count
+            self.busy += seconds
+
+    def summary(self, elapsed: float) -> str:
+        rate = self.count / elapsed if elapsed > 0 else 0.0
+        return f"{self.name} {self.count} 篇 ({rate:.1f}/s, 忙碌 {self.busy:.0f}s)"
+
+
+# ==== 融合流水线：解析 → 向量化 → 写入 Milvus，各阶段并发运行，队列有界提供背压 ====
+class StreamPipeline:
+    def __init__(self, collection: Collection, sources: List[str], article_filter: Optional[ArticleFilter] = None,
+                 concurrency: int = CONCURRENCY, queue_size: int = QUEUE_SIZE,
+                 batch_size: int = EMBEDDING_BATCH_SIZE, insert_chunk_size: int = INSERT_CHUNK_SIZE):
+        self.collection = collection
+        self.sources = sources
+        self.article_filter = article_filter
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.insert_chunk_size = insert_chunk_size
+        self.store = get_embedding_store()
+        self.client = EmbeddingClient(pool_size=concurrency, store=self.store)
+        self.parsed_queue: "queue.Queue[Any]" = queue.Queue(maxsize=queue_size)
+        self.embedded_queue: "queue.Queue[Any]" = queue.Queue(maxsize=queue_size)
+        self.stats = {name: StageStats(name) for name in ("parse", "embed", "insert")}
+        self.deleted: List[str] = []
+        self.failed = 0
+        self.sent = 0  # 已送入流水线的记录数
+        self.done = 0  # 已写入或已确认失败的记录数
+        self.error: Optional[BaseException] = None
+        self._stop = threading.Event()
+        self._barrier = threading.Event()  # 等待删除前的写入全部落地
+        self._lock = threading.Lock()
+
+    def _put(self, q: queue.Queue, item: Any):
+        # 下游异常退出时不要永远阻塞在满队列上
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def _send(self, batch: List[Dict]):
+        with self._lock:
+            self.sent += len(batch)
+        self._put(self.parsed_queue, batch)
+
+    def _mark_done(self, count: int):
+        with self._lock:
+            self.done += count
+
+    def _apply_deletions(self, pmids: List[str]):
+        # 删除必须在本文件的写入之后、下一个文件的写入之前执行：先等在途记录全部写入或失败
+        self._barrier.set()
+        while not self._stop.is_set():
+            with self._lock:
+                if self.done >= self.sent:
+                    break
+            time.sleep(0.1)
+        self._barrier.clear()
+        if self._stop.is_set() or self.error is not None:
+            return  # 流水线已出错，跳过删除
+        delete_pmids(self.collection, pmids)
+        self.deleted.extend(pmids)
+
+    def _parse_stage(self):
+        try:
+            batch: List[Dict] = []
+            for file_path in self.sources:
+                started = time.perf_counter()
+                deleted: List[str] = []
+                for kind, item in iter_pubmed_file(file_path, self.article_filter):
+                    if self._stop.is_set():
+                        return
+                    if kind == "delete":
+                        deleted.extend(item)
+                        continue
+                    if not all(k in item for k in REQUIRED_FIELDS):
+                        continue
+                    batch.append(item)
+                    if len(batch) >= self.batch_size:
+                        self.stats["parse"].add(len(batch), time.perf_counter() - started)
+                        self._send(batch)
+                        batch = []
+                        started = time.perf_counter()
+                if deleted:
+                    if batch:
+                        self.stats["parse"].add(len(batch), time.perf_counter() - started)
+                        self._send(batch)
+                        batch = []
+                    self._apply_deletions(deleted)
+            if batch:
+                self.stats["parse"].add(len(batch), 0.0)
+                self._send(batch)
+        except Exception as e:
+            # 已解析的记录照常写完，run() 结束时再抛出
+            print(f"❌ 解析失败，停止读取后续文件: {e}")
+            self.error = e
+        finally:
+            for _ in range(self.concurrency):
+                self._put(self.parsed_queue, _DONE)
+
+    def _embed_stage(self):
+        try:
+            while not self._stop.is_set():
+                batch = self.parsed_queue.get()
+                if batch is _DONE:
+                    return
+                started = time.perf_counter()
+                texts = [f"{doc['title']} {doc['abstract']}".strip() for doc in batch]
+                try:
+                    embeddings = self.client.embed(texts, raise_on_error=False)
+                except EmbeddingUnavailableError as e:
+                    print(f"❌ 向量化服务不可用，停止流水线: {e}")
+                    self.error = e
+                    self._stop.set()
+                    return
+                except Exception as e:
+                    print(f"❌ 批次向量化失败: {e}")
+                    embeddings = [None] * len(batch)
+                keep = [i for i, e in enumerate(embeddings) if e is not None]
+                with self._lock:
+                    self.failed += len(batch) - len(keep)
+                    self.done += len(batch) - len(keep)
+                self.stats["embed"].add(len(keep), time.perf_counter() - started)
+                if keep:
+                    vectors = np.asarray([embeddings[i] for i in keep], dtype=np.float32)
+                    self._put(self.embedded_queue, ([batch[i] for i in keep], vectors))
+        finally:
+            self._put(self.embedded_queue, _DONE)
+
+    def _insert_stage(self):
+        docs: List[Dict] = []
+        vectors: List[np.ndarray] = []
+        pending = self.concurrency
+        try:
+            while pending:
+                try:
+                    item = self.embedded_queue.get(timeout=0.5)
+                except queue.Empty:
+                    if self._stop.is_set():
+                        return
+                    if self._barrier.is_set():
+                        # 解析阶段在等待执行删除：先写入缓冲中的记录
+                        self._insert(docs, vectors)
+                        docs, vectors = [], []
+                    continue
+                if item is _DONE:
+                    pending -= 1
+                    continue
+                docs.extend(item[0])
+                vectors.append(item[1])
+                if len(docs) >= self.insert_chunk_size:
+                    self._insert(docs, vectors)
+                    docs, vectors = [], []
+            self._insert(docs, vectors)
+        except Exception as e:
+            print(f"❌ 写入 Milvus 失败，停止流水线: {e}")
+            self.error = e
+            self._stop.set()
+
+    def _insert(self, docs: List[Dict], vectors: List[np.ndarray]):
+        if not docs:
+            return
+        started = time.perf_counter()
+        insert_to_milvus(self.collection, docs, np.concatenate(vectors), flush=False)
+        self.stats["insert"].add(len(docs), time.perf_counter() - started)
+        self._mark_done(len(docs))
+
+    def _report(self, started: float, final: bool = False):
+        elapsed = time.perf_counter() - started
+        line = " | ".join(s.summary(elapsed) for s in self.stats.values())
+        if final:
+            print(f"✅ 流水线完成，用时 {elapsed:.0f}s：{line}，向量化失败 {self.failed} 篇，撤回 {len(self.deleted)} 篇")
+        else:
+            print(f"📊 {line} | 队列 {self.parsed_queue.qsize()}/{self.embedded_queue.qsize()}")
+
+    def run(self):
+        started = time.perf_counter()
+        threads = [threading.Thread(target=self._parse_stage, name="parse", daemon=True)]
+        threads += [threading.Thread(target=self._embed_stage, name=f"embed-{i}", daemon=True)
+                    for i in range(self.concurrency)]
+        inserter = threading.Thread(target=self._insert_stage, name="insert", daemon=True)
+        threads.append(inserter)
+        for t in threads:
+            t.start()
+
+        while inserter.is_alive():
+            inserter.join(timeout=REPORT_INTERVAL)
+            if inserter.is_alive():
+                self._report(started)
+        self._stop.set()
+        if self.error is not None:
+            raise RuntimeError(f"流水线中止: {self.error}")
+
+        self.collection.flush()
+        bump_collection_generation(COLLECTION_NAME)  # 使 MCP Server 的检索结果缓存失效
+        self.client.close()
+        self._report(started, final=True)
+        if self.store is not None:
+            print(self.store.report())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="流式流水线：XML → 记录 → 向量 → Milvus，不落地中间文件")
+    add_source_arguments(parser)
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="同时在途的 embedding 请求数")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE, help="阶段间缓冲的批次数")
+    parser.add_argument("--insert-chunk", type=int, default=INSERT_CHUNK_SIZE, help="每次写入 Milvus 的条数")
+    args = parser.parse_args()
+
+    connections.connect("default", host="localhost", port="19530")
+    collection = Collection(COLLECTION_NAME)
+    collection.load()
+    StreamPipeline(
+        collection,
+        list_sources(args.mirror),
+        article_filter=build_filter(args),
+        concurrency=args.concurrency,
+        queue_size=args.queue_size,
+        insert_chunk_size=args.insert_chunk,
+    ).run()
@@ -1,18 +1,23 @@
 import os
+import json
 import time
-import requests
-from typing import List, Dict
+import argparse
+from datetime import date, datetime
+from typing import List, Dict, Optional
 from pymilvus import Collection, connections
 from Bio import Entrez
 from dotenv import load_dotenv
+from collection_schema import parse_year, vector_dtype_of, write_by_partition
+from embedding_client import EmbeddingClient
+from embedding_store import get_embedding_store
+from doc_store import hydrate_rows, lean_fields
+from query_cache import bump_collection_generation
+from vector_codec import decode_vector
 
 # ================= 配置区 =================
 load_dotenv()
 ENTREZ_EMAIL = os.getenv("ENTREZ_EMAIL")
 ENTREZ_API_KEY = os.getenv("ENTREZ_API_KEY")
-EMBEDDING_API_URL = os.getenv("EMBEDDING_API_URL")
-EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL")
-EMBEDDING_DIM = 1024
 SLEEP_INTERVAL = 0.2
 SEARCH_BATCH_SIZE = 100
 FETCH_BATCH_SIZE = 100
@@ -20,17 +25,26 @@ FETCH_BATCH_SIZE = 100
 Entrez.email = ENTREZ_EMAIL
 Entrez.api_key = ENTREZ_API_KEY
 PUBMED_COLLECTION_NAME = "pubmed_rare_disease_db"
+PUBMED_QUERY = "rare disease"
+INITIAL_DAYS = 30  # 首次运行（还没有水位线）时回溯的天数
+# 水位线：上次成功运行的日期，以及上次向量化失败、需要重试的 PMID
+WATERMARK_FILE = os.getenv("UPDATE_WATERMARK_FILE", "updating_milvusdb.watermark.json")
+# mdat = 最后修改日期，新增和修订的文献都会落在窗口内
+WINDOW_DATETYPE = os.getenv("UPDATE_DATETYPE", "mdat")
+EXISTING_QUERY_BATCH = 500
+TEXT_FIELDS = ["title", "abstract"]
+META_FIELDS = ["doi", "authors", "journal", "year", "source"]
 
-# ============ 获取近期PMID列表 ============
-def fetch_pubmed_ids_recent_days(query: str, days: int = 30, retmax: int = 100) -> List[str]:
+# ============ 按日期窗口获取PMID列表 ============
+def fetch_pubmed_ids(query: str, retmax: int = 100, datetype: str = "pdat", **date_params) -> List[str]:
     initial = Entrez.esearch(
         db="pubmed",
         term=query,
-        reldate=days,
-        datetype="pdat",
+        datetype=datetype,
         retmax=0,
         usehistory="y",
-        retmode="xml"
+        retmode="xml",
+        **date_params
     )
     record = Entrez.read(initial)
     initial.close()
@@ -38,7 +52,7 @@ def fetch_pubmed_ids_recent_days(query: str, days: int = 30, retmax: int = 100)
     total_count = int(record["Count"])
     webenv = record["WebEnv"]
     query_key = record["QueryKey"]
-    print(f"📊 PubMed中最近 {days} 天共找到 {total_count} 篇文献")
+    print(f"📊 PubMed中 {datetype} {date_params} 共找到 {total_count} 篇文献")
 
     all_pmids = []
     for start in range(0, total_count, retmax):
@@ -46,14 +60,14 @@ def fetch_pubmed_ids_recent_days(query: str, days: int = 30, retmax: int = 100)
         handle = Entrez.esearch(
             db="pubmed",
             term=query,
-            reldate=days,
-            datetype="pdat",
+            datetype=datetype,
             retstart=start,
             retmax=retmax,
             usehistory="y",
             webenv=webenv,
             query_key=query_key,
-            retmode="xml"
+            retmode="xml",
+            **date_params
         )
         batch = Entrez.read(handle)
         handle.close()
@@ -63,6 +77,10 @@ def fetch_pubmed_ids_recent_days(query: str, days: int = 30, retmax: int = 100)
     print(f"✅ 共成功获取 {len(all_pmids)} 条PMID")
     return all_pmids
 
+# ============ 获取近期PMID列表 ============
+def fetch_pubmed_ids_recent_days(query: str, days: int = 30, retmax: int = 100) -> List[str]:
+    return fetch_pubmed_ids(query, retmax=retmax, datetype="pdat", reldate=days)
+
 # ============ 获取特定年份范围内的PMID列表 ============
 # def fetch_pubmed_ids_by_year_range(query: str, mindate: str = "2015", maxdate: str = "2025", retmax: int = 100) -> List[str]:
 #     initial = Entrez.esearch(
@@ -154,7 +172,7 @@ def fetch_pubmed_details(pmids: List[str], batch_size: int = 100, sleep_time: fl
                     "authors": ", ".join(authors),
                     "doi": doi,
                     "journal": journal,
-                    "year": pub_year,
+                    "year": parse_year(pub_year),
                     "source": "PubMed"
                 })
             except Exception as e:
@@ -164,25 +182,9 @@ def fetch_pubmed_details(pmids: List[str], batch_size: int = 100, sleep_time: fl
     print(f"✅ 获取完毕，总共 {len(results)} 篇")
     return results
 
-# ============ 嵌入模型调用 ============
-def get_embedding(text: str) -> List[float]:
-    payload = {
-        "input": [text],
-        "model": EMBEDDING_MODEL
-    }
-    response = requests.post(EMBEDDING_API_URL, json=payload)
-    response.raise_for_status()
-    embedding = response.json()["data"][0]["embedding"]
-    if len(embedding) != EMBEDDING_DIM:
-        raise ValueError(f"Embedding dim mismatch: {len(embedding)} != {EMBEDDING_DIM}")
-    return embedding
-
 # ============ 插入 Milvus ============
-def insert_to_milvus(collection: Collection, docs: List[Dict]):
-    if not docs:
-        return
-    print(f"📦 插入 Milvus：共 {len(docs)} 篇")
-    entities = [
+def to_entities(docs: List[Dict]) -> List[List]:
+    return [
         [doc["pmid"] for doc in docs],
         [doc["title"] for doc in docs],
         [doc["abstract"] for doc in docs],
@@ -193,28 +195,145 @@ def insert_to_milvus(collection: Collection, docs: List[Dict]):
         [doc["source"] for doc in docs],
         [doc["embedding"] for doc in docs],
     ]
-    collection.insert(entities)
+
+def insert_to_milvus(collection: Collection, docs: List[Dict]):
+    if not docs:
+        return
+    print(f"📦 插入 Milvus：共 {len(docs)} 篇")
+    write_by_partition(collection, to_entities(docs), [doc["year"] for doc in docs])  # 按年份写入对应分区
     collection.flush()
+    bump_collection_generation(collection.name)  # 使 MCP Server 的检索结果缓存失效
     print("✅ 插入完成")
 
+# ============ Upsert Milvus（按 pmid 覆盖，重复运行不会产生重复行） ============
+def upsert_to_milvus(collection: Collection, docs: List[Dict]):
+    if not docs:
+        return
+    print(f"📦 Upsert Milvus：共 {len(docs)} 篇")
+    write_by_partition(collection, to_entities(docs), [doc["year"] for doc in docs], upsert=True)
+    collection.flush()
+    bump_collection_generation(collection.name)
+    print("✅ Upsert 完成")
+
+# ============ 批量查询已入库的文献 ============
+def fetch_existing(collection: Collection, pmids: List[str]) -> Dict[str, Dict]:
+    # 只取比对用的标量字段；需要沿用的向量由 fetch_vectors 按主键另取
+    existing = {}
+    names = {f.name for f in collection.schema.fields}
+    output_fields = [f for f in ["pmid"] + TEXT_FIELDS + META_FIELDS if f in names]
+    for i in range(0, len(pmids), EXISTING_QUERY_BATCH):
+        batch = pmids[i:i + EXISTING_QUERY_BATCH]
+        rows = collection.query(expr=f"pmid in {json.dumps(batch)}", output_fields=output_fields)
+        found = {row["pmid"]: dict(row) for row in rows}
+        existing.update(hydrate_rows(found, list(found), lean_fields(names)))  # 精简 schema：正文从本地文档库读取
+    return existing
+
+def fetch_vectors(collection: Collection, pmids: List[str]) -> Dict[str, List[float]]:
+    vectors = {}
+    vector_dtype = vector_dtype_of(collection)
+    for i in range(0, len(pmids), EXISTING_QUERY_BATCH):
+        batch = pmids[i:i + EXISTING_QUERY_BATCH]
+        for row in collection.query(expr=f"pmid in {json.dumps(batch)}", output_fields=["pmid", "embedding"]):
+            vectors[row["pmid"]] = decode_vector(row["embedding"], vector_dtype).tolist()
+    return vectors
+
+# ============ 水位线 ============
+def load_watermark() -> Dict:
+    if not os.path.exists(WATERMARK_FILE):
+        return {}
+    with open(WATERMARK_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_watermark(run_date: date, pending_pmids: List[str]):
+    tmp_path = WATERMARK_FILE + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "last_success": run_date.strftime("%Y/%m/%d"),
+            "updated_at": datetime.now().isoformat(timespec="seconds"),
+            "pending_pmids": pending_pmids,
+        }, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, WATERMARK_FILE)
+
+def embed_docs(docs: List[Dict], client: EmbeddingClient) -> List[Dict]:
+    # 返回向量化成功的文档；失败的留到下次运行重试
+    embedded = []
+    for i in range(0, len(docs), 100):
+        batch = docs[i:i+100]
+        texts = [f"{doc['title']} {doc['abstract']}" for doc in batch]
+        embeddings = client.embed(texts, raise_on_error=False)  # 整批一次请求
+        for doc, embedding in zip(batch, embeddings):
+            if embedding is None:
+                print(f"❌ Embedding 失败: {doc['pmid']}")
+                continue
+            doc["embedding"] = embedding
+            embedded.append(doc)
+    return embedded
+
+# ============ 增量更新：只处理窗口内新增 / 修订的文献 ============
+def run_incremental(collection: Collection, days: Optional[int] = None):
+    today = date.today()
+    watermark = load_watermark()
+    if days is not None:
+        date_params = {"reldate": days}
+    elif watermark.get("last_success"):
+        # 从上次成功的日期（含当天）开始，重叠的部分会被下面的去重过滤掉
+        date_params = {"mindate": watermark["last_success"], "maxdate": today.strftime("%Y/%m/%d")}
+    else:
+        date_params = {"reldate": INITIAL_DAYS}
+
+    pmids = fetch_pubmed_ids(PUBMED_QUERY, retmax=SEARCH_BATCH_SIZE, datetype=WINDOW_DATETYPE, **date_params)
+    pmids = list(dict.fromkeys(watermark.get("pending_pmids", []) + pmids))
+    records = fetch_pubmed_details(pmids, batch_size=FETCH_BATCH_SIZE, sleep_time=SLEEP_INTERVAL)
+    existing = fetch_existing(collection, [doc["pmid"] for doc in records])
+
+    to_embed, meta_only, unchanged = [], [], 0
+    for doc in records:
+        old = existing.get(doc["pmid"])
+        if old is None or any(str(old.get(k, "")) != str(doc[k]) for k in TEXT_FIELDS):
+            to_embed.append(doc)  # 新文献或标题/摘要有修订
+        elif any(str(old.get(k, "")) != str(doc[k]) for k in META_FIELDS):
+            meta_only.append(doc)
+        else:
+            unchanged += 1
+    vectors = fetch_vectors(collection, [doc["pmid"] for doc in meta_only])
+    # 两次查询之间被删除的行没有向量可沿用，改为重新向量化
+    to_embed += [doc for doc in meta_only if doc["pmid"] not in vectors]
+    meta_only = [doc for doc in meta_only if doc["pmid"] in vectors]
+    for doc in meta_only:
+        doc["embedding"] = vectors[doc["pmid"]]  # 只改了元数据，沿用已有向量
+    print(f"🧮 新增/修订 {len(to_embed)} 篇，仅元数据变化 {len(meta_only)} 篇，未变化跳过 {unchanged} 篇")
+
+    embedded = embed_docs(to_embed, EmbeddingClient(store=get_embedding_store()))  # 先查内容哈希向量库
+    docs = embedded + meta_only
+    # 年份被修订的文献要换分区：upsert 只在目标分区内覆盖，先删除旧分区里的那一行
+    moved = [doc["pmid"] for doc in docs
+             if doc["pmid"] in existing and parse_year(existing[doc["pmid"]].get("year")) != doc["year"]]
+    if moved:
+        collection.delete(expr=f"pmid in {json.dumps(moved)}")
+    for i in range(0, len(docs), 100):
+        upsert_to_milvus(collection, docs[i:i+100])
+
+    # 待重试：efetch 批次失败 / 单篇解析失败而没有拿到的，以及向量化失败的
+    fetched_pmids = {doc["pmid"] for doc in records}
+    embedded_pmids = {doc["pmid"] for doc in embedded}
+    pending = [pmid for pmid in pmids if pmid not in fetched_pmids]
+    pending += [doc["pmid"] for doc in to_embed if doc["pmid"] not in embedded_pmids]
+    save_watermark(today, pending)
+    print(f"🏁 增量更新完成，水位线 {today}，待重试 {len(pending)} 篇")
+    store = get_embedding_store()
+    if store is not None:
+        print(store.report())
+
 # ============ 主流程 ============
 def main():
+    parser = argparse.ArgumentParser(description="定时增量更新 PubMed 文献到 Milvus")
+    parser.add_argument("--days", type=int, default=None, help="忽略水位线，处理最近 N 天的窗口（仍会去重）")
+    args = parser.parse_args()
+
     connections.connect()
     collection = Collection(PUBMED_COLLECTION_NAME)
-    
-    pmids = fetch_pubmed_ids_recent_days(query="rare disease",days=30, retmax=SEARCH_BATCH_SIZE)
-    records = fetch_pubmed_details(pmids, batch_size=FETCH_BATCH_SIZE, sleep_time=SLEEP_INTERVAL)
-
-    for i in range(0, len(records), 100):
-        batch = records[i:i+100]
-        for doc in batch:
-            text = f"{doc['title']} {doc['abstract']}"
-            try:
-                doc["embedding"] = get_embedding(text)
-            except Exception as e:
-                print(f"❌ Embedding 失败: {doc['pmid']}: {e}")
-                doc["embedding"] = [0.0] * EMBEDDING_DIM  # 填充空向量避免插入错误
-        insert_to_milvus(collection, batch)
+    collection.load()
+    run_incremental(collection, days=args.days)
 
 if __name__ == "__main__":
     main()
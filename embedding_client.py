@@ -0,0 +1,316 @@
+import os
+import time
+import asyncio
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import find_dotenv, load_dotenv
+from embedding_store import EmbeddingStore, content_key
+
+# ==== 配置 ====
+load_dotenv(find_dotenv(usecwd=True))  # 从运行目录查找 .env（各子目录脚本各有自己的配置）
+EMBEDDING_API_URL = os.getenv("EMBEDDING_API_URL")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL")
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "1024"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))            # 单次请求最多多少条文本
+EMBEDDING_MAX_BATCH_TOKENS = int(os.getenv("EMBEDDING_MAX_BATCH_TOKENS", "32000"))  # 单次请求的 token 预算
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "3"))
+EMBEDDING_TIMEOUT = float(os.getenv("EMBEDDING_TIMEOUT", "60"))
+EMBEDDING_POOL_SIZE = int(os.getenv("EMBEDDING_POOL_SIZE", "8"))               # keep-alive 连接池大小
+RETRY_BACKOFF = 1.0
+
+
+class EmbeddingError(RuntimeError):
+    pass
+
+
+class EmbeddingUnavailableError(EmbeddingError):
+    # 5xx / 超时 / 连接失败且重试用尽：服务端问题，拆分批次也无济于事
+    pass
+
+
+# ==== token 估算 ====
+def estimate_tokens(text: str) -> int:
+    # 粗略估算：英文约 4 个字符 1 个 token，无需依赖具体模型的 tokenizer
+    return max(1, len(text) // 4)
+
+
+# ==== 按条数与 token 预算切分批次 ====
+def iter_batches(texts: Sequence[str], batch_size: int, max_batch_tokens: int) -> Iterator[List[int]]:
+    batch, batch_tokens = [], 0
+    for i, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if batch and (len(batch) >= batch_size or batch_tokens + tokens > max_batch_tokens):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append(i)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+
+# ==== 响应解析 ====
+def parse_embedding_response(body: Dict[str, Any], expected: int, dim: int) -> List[List[float]]:
+    data = body["data"]
+    if len(data) != expected:
+        raise ValueError(f"Embedding count mismatch: {len(data)} != {expected}")
+    # OpenAI 兼容接口带 index 字段，按 index 还原输入顺序
+    data = sorted(data, key=lambda d: d.get("index", 0))
+    embeddings = [d["embedding"] for d in data]
+    for embedding in embeddings:
+        if len(embedding) != dim:
+            raise ValueError(f"Embedding dim mismatch: {len(embedding)} != {dim}")
+    return embeddings
+
+
+def is_retryable_status(status: Optional[int]) -> bool:
+    # 4xx（除限流外，含 413 请求过大）重试无意义，直接拆分批次；其余错误重试后快速失败
+    return status is None or not (400 <= status < 500 and status != 429)
+
+
+def retry_delay(attempt: int, max_retries: int) -> float:
+    # 最后一次尝试失败后不再等待
+    return RETRY_BACKOFF * (2 ** attempt) if attempt + 1 < max_retries else 0.0
+
+
+# ==== 内容哈希向量库：命中的文本不再请求接口 ====
+def lookup_store(store: Optional[EmbeddingStore], texts: List[str], model: str, dim: int,
+                 results: List[Optional[List[float]]]) -> List[int]:
+    # 把命中的向量填入 results，返回仍需请求接口的下标
+    if store is None:
+        return list(range(len(texts)))
+    keys = [content_key(text, model) for text in texts]
+    found = store.get_many(keys, dim)
+    todo = []
+    for i, key in enumerate(keys):
+        if key in found:
+            results[i] = found[key]
+        else:
+            todo.append(i)
+    return todo
+
+
+def save_store(store: Optional[EmbeddingStore], texts: List[str], model: str,
+               indices: List[int], embeddings: List[Optional[List[float]]]):
+    if store is None:
+        return
+    store.put_many(
+        ((content_key(texts[i], model), e) for i, e in zip(indices, embeddings) if e is not None), model
+    )
+
+
+# ==== 批量、连接复用的 embedding 客户端 ====
+class EmbeddingClient:
+    def __init__(
+        self,
+        api_url: Optional[str] = None,
+        model: Optional[str] = None,
+        dim: int = EMBEDDING_DIM,
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+        max_batch_tokens: int = EMBEDDING_MAX_BATCH_TOKENS,
+        max_retries: int = EMBEDDING_MAX_RETRIES,
+        timeout: float = EMBEDDING_TIMEOUT,
+        pool_size: int = EMBEDDING_POOL_SIZE,
+        store: Optional[EmbeddingStore] = None,
+    ):
+        self.api_url = api_url or EMBEDDING_API_URL
+        self.model = model or EMBEDDING_MODEL
+        self.dim = dim
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_retries = max_retries
+        self.store = store
+        self.timeout = timeout
+
+        # 复用同一个 Session，避免每次请求重新建立 TCP/TLS 连接
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _post(self, texts: List[str]) -> List[List[float]]:
+        payload = {
+            "input": texts,
+            "model": self.model
+        }
+        response = self.session.post(self.api_url, json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        return parse_embedding_response(response.json(), len(texts), self.dim)
+
+    def _embed_batch(self, texts: List[str]) -> List[Optional[List[float]]]:
+        last_error = None
+        for attempt in range(self.max_retries):
+            try:
+                return self._post(texts)
+            except requests.HTTPError as e:
+                last_error = e
+                if not is_retryable_status(e.response.status_code if e.response is not None else None):
+                    return self._split_batch(texts, e)
+            except (requests.RequestException, ValueError, KeyError) as e:
+                last_error = e
+            time.sleep(retry_delay(attempt, self.max_retries))
+        raise EmbeddingUnavailableError(f"向量化服务不可用（已重试 {self.max_retries} 次）: {last_error}")
+
+    def _split_batch(self, texts: List[str], error: Exception) -> List[Optional[List[float]]]:
+        if len(texts) == 1:
+            raise EmbeddingError(f"向量化失败: {error}")
+
+        # 请求被拒（4xx / 请求过大）：对半拆分后分别重试，把坏样本隔离出来
+        mid = len(texts) // 2
+        print(f"⚠️ 批次({len(texts)} 条)被拒，拆分重试: {error}")
+        return self._embed_split(texts[:mid]) + self._embed_split(texts[mid:])
+
+    def _embed_split(self, texts: List[str]) -> List[Optional[List[float]]]:
+        try:
+            return self._embed_batch(texts)
+        except EmbeddingUnavailableError:
+            raise
+        except EmbeddingError as e:
+            if len(texts) > 1:
+                raise
+            print(f"❌ {e}")
+            return [None]
+
+    def embed(self, texts: Sequence[str], raise_on_error: bool = True) -> List[Optional[List[float]]]:
+        """
+        批量向量化，按 batch_size 与 max_batch_tokens 打包请求
+
+        Args:
+            texts: 待向量化的文本
+            raise_on_error: 为 False 时，失败的文本返回 None 而不是抛出异常
+
+        配置了 store 时先查内容哈希向量库，只对未命中的文本发起请求
+
+        Returns:
+            与 texts 一一对应的向量列表
+        """
+        texts = list(texts)
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        todo = lookup_store(self.store, texts, self.model, self.dim, results)
+        for batch_indices in iter_batches([texts[i] for i in todo], self.batch_size, self.max_batch_tokens):
+            indices = [todo[i] for i in batch_indices]
+            batch = [texts[i] for i in indices]
+            embeddings = self._embed_batch(batch) if raise_on_error else self._embed_split(batch)
+            save_store(self.store, texts, self.model, indices, embeddings)
+            if raise_on_error and any(e is None for e in embeddings):
+                raise EmbeddingError("部分文本向量化失败")
+            for i, embedding in zip(indices, embeddings):
+                results[i] = embedding
+        return results
+
+    def embed_one(self, text: str) -> List[float]:
+        return self.embed([text])[0]
+
+    def close(self):
+        self.session.close()
+
+
+# ==== 异步版本：共享 httpx.AsyncClient，供 asyncio 并发场景使用 ====
+class AsyncEmbeddingClient:
+    def __init__(
+        self,
+        api_url: Optional[str] = None,
+        model: Optional[str] = None,
+        dim: int = EMBEDDING_DIM,
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+        max_batch_tokens: int = EMBEDDING_MAX_BATCH_TOKENS,
+        max_retries: int = EMBEDDING_MAX_RETRIES,
+        timeout: float = EMBEDDING_TIMEOUT,
+        pool_size: int = EMBEDDING_POOL_SIZE,
+        store: Optional[EmbeddingStore] = None,
+    ):
+        self.api_url = api_url or EMBEDDING_API_URL
+        self.model = model or EMBEDDING_MODEL
+        self.dim = dim
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_retries = max_retries
+        self.store = store
+        self.client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        )
+
+    async def _post(self, texts: List[str]) -> List[List[float]]:
+        payload = {
+            "input": texts,
+            "model": self.model
+        }
+        response = await self.client.post(self.api_url, json=payload)
+        response.raise_for_status()
+        return parse_embedding_response(response.json(), len(texts), self.dim)
+
+    async def _embed_batch(self, texts: List[str]) -> List[Optional[List[float]]]:
+        last_error = None
+        for attempt in range(self.max_retries):
+            try:
+                return await self._post(texts)
+            except httpx.HTTPStatusError as e:
+                last_error = e
+                if not is_retryable_status(e.response.status_code):
+                    return await self._split_batch(texts, e)
+            except (httpx.HTTPError, ValueError, KeyError) as e:
+                last_error = e
+            await asyncio.sleep(retry_delay(attempt, self.max_retries))
+        raise EmbeddingUnavailableError(f"向量化服务不可用（已重试 {self.max_retries} 次）: {last_error}")
+
+    async def _split_batch(self, texts: List[str], error: Exception) -> List[Optional[List[float]]]:
+        if len(texts) == 1:
+            raise EmbeddingError(f"向量化失败: {error}")
+
+        mid = len(texts) // 2
+        print(f"⚠️ 批次({len(texts)} 条)被拒，拆分重试: {error}")
+        return await self._embed_split(texts[:mid]) + await self._embed_split(texts[mid:])
+
+    async def _embed_split(self, texts: List[str]) -> List[Optional[List[float]]]:
+        try:
+            return await self._embed_batch(texts)
+        except EmbeddingUnavailableError:
+            raise
+        except EmbeddingError as e:
+            if len(texts) > 1:
+                raise
+            print(f"❌ {e}")
+            return [None]
+
+    async def embed(self, texts: Sequence[str], raise_on_error: bool = True) -> List[Optional[List[float]]]:
+        texts = list(texts)
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        todo = lookup_store(self.store, texts, self.model, self.dim, results)
+        for batch_indices in iter_batches([texts[i] for i in todo], self.batch_size, self.max_batch_tokens):
+            indices = [todo[i] for i in batch_indices]
+            batch = [texts[i] for i in indices]
+            embeddings = await (self._embed_batch(batch) if raise_on_error else self._embed_split(batch))
+            save_store(self.store, texts, self.model, indices, embeddings)
+            if raise_on_error and any(e is None for e in embeddings):
+                raise EmbeddingError("部分文本向量化失败")
+            for i, embedding in zip(indices, embeddings):
+                results[i] = embedding
+        return results
+
+    async def embed_one(self, text: str) -> List[float]:
+        return (await self.embed([text]))[0]
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+# ==== 进程内共享的默认客户端：不带内容哈希向量库，检索时的查询向量不写入入库用的 store ====
+# 入库脚本（generate_embeding.py / stream_pipeline.py / download_pubmed_to_milvusdb_2.py）自行创建带 store 的客户端
+_default_client: Optional[EmbeddingClient] = None
+
+
+def get_default_client() -> EmbeddingClient:
+    global _default_client
+    if _default_client is None:
+        _default_client = EmbeddingClient()
+    return _default_client
+
+
+def get_embedding(text: str) -> List[float]:
+    return get_default_client().embed_one(text)
+
+
+def get_embeddings(texts: Sequence[str], raise_on_error: bool = True) -> List[Optional[List[float]]]:
+    return get_default_client().embed(texts, raise_on_error=raise_on_error)
@@ -0,0 +1,93 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from array import array
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from dotenv import find_dotenv, load_dotenv
+
+# ==== 配置 ====
+load_dotenv(find_dotenv(usecwd=True))
+# 设为空字符串即关闭；默认放在仓库根目录的 .cache/ 下，各阶段脚本共用
+EMBEDDING_STORE_PATH = os.getenv(
+    "EMBEDDING_STORE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "embedding_store.sqlite")
+)
+LOOKUP_BATCH = 500
+
+
+# ==== 文本归一化 + 模型名 → 内容哈希 ====
+def normalize_text(text: str) -> str:
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+
+def content_key(text: str, model: str) -> str:
+    return hashlib.sha256(f"{model}\x00{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+# ==== 持久化向量库：SQLite，float32 BLOB，跨运行复用已算过的向量 ====
+class EmbeddingStore:
+    def __init__(self, path: str = EMBEDDING_STORE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embedding ("
+            "key TEXT PRIMARY KEY, model TEXT, dim INTEGER, vector BLOB, created REAL)"
+        )
+        self._db.commit()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    def get_many(self, keys: Sequence[str], dim: int) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        unique = list(dict.fromkeys(keys))
+        with self._lock:
+            for i in range(0, len(unique), LOOKUP_BATCH):
+                batch = unique[i:i + LOOKUP_BATCH]
+                rows = self._db.execute(
+                    f"SELECT key, dim, vector FROM embedding WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                for key, row_dim, blob in rows:
+                    if row_dim == dim:
+                        found[key] = array("f", blob).tolist()
+            self.hits += sum(1 for k in keys if k in found)
+            self.misses += sum(1 for k in keys if k not in found)
+        return found
+
+    def put_many(self, items: Iterable[Tuple[str, List[float]]], model: str):
+        now = time.time()
+        rows = [(key, model, len(vector), array("f", vector).tobytes(), now) for key, vector in items]
+        if not rows:
+            return
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO embedding VALUES (?, ?, ?, ?, ?)", rows)
+            self._db.commit()
+            self.writes += len(rows)
+
+    def report(self) -> str:
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        return f"💾 向量库命中 {self.hits}/{total} 条 ({rate:.1%})，节省 {self.hits} 次向量化，新写入 {self.writes} 条"
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_default_store: Optional[EmbeddingStore] = None
+
+
+def get_embedding_store() -> Optional[EmbeddingStore]:
+    global _default_store
+    if not EMBEDDING_STORE_PATH:
+        return None
+    if _default_store is None:
+        _default_store = EmbeddingStore(EMBEDDING_STORE_PATH)
+    return _default_store
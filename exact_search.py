@@ -0,0 +1,194 @@
+import os
+import re
+import json
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from pymilvus import connections, Collection
+from dotenv import find_dotenv, load_dotenv
+from collection_schema import OUTPUT_FIELDS, vector_dtype_of
+from doc_store import hydrate_rows, lean_fields
+from index_profiles import VECTOR_FIELD
+from vector_codec import VECTOR_DTYPE, decode_vector, sidecar_dtype
+from vector_sidecar import read_sidecar, sidecar_paths, write_sidecar
+
+# ==== 配置 ====
+load_dotenv(find_dotenv(usecwd=True))
+# 快照 = vector_sidecar 格式：<base>.jsonl（pmid + 元数据，按行对齐）+ <base>.npy（内存映射的向量矩阵）
+EXACT_SNAPSHOT = os.getenv(
+    "EXACT_SNAPSHOT",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "exact_snapshot")
+)
+EXACT_BLOCK = int(os.getenv("EXACT_BLOCK", "16384"))                     # 每块的向量数，控制临时内存
+EXACT_THREADS = int(os.getenv("EXACT_THREADS", str(os.cpu_count() or 4)))  # 并行计算的块数
+EXPORT_BATCH = 1000
+
+
+# ==== 分块 top-k：余弦 = 归一化后的内积 ====
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def empty_top_k(num_queries: int) -> Tuple[np.ndarray, np.ndarray]:
+    return np.full((num_queries, 0), -np.inf, dtype=np.float32), np.zeros((num_queries, 0), dtype=np.int64)
+
+
+def merge_top_k(best_scores: np.ndarray, best_ids: np.ndarray, scores: np.ndarray, ids: np.ndarray,
+                k: int) -> Tuple[np.ndarray, np.ndarray]:
+    # scores 的第 j 列对应底库第 ids[j] 行（ids 为一维或与 scores 同形）；返回未排序的 top-k
+    ids = np.broadcast_to(ids, scores.shape)
+    scores = np.concatenate([best_scores, scores], axis=1)
+    ids = np.concatenate([best_ids, ids], axis=1)
+    keep = min(k, scores.shape[1])
+    if keep == 0:
+        return scores, ids
+    top = np.argpartition(-scores, keep - 1, axis=1)[:, :keep]
+    return np.take_along_axis(scores, top, axis=1), np.take_along_axis(ids, top, axis=1)
+
+
+def sort_top_k(best_scores: np.ndarray, best_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    order = np.argsort(-best_scores, axis=1)
+    return np.take_along_axis(best_scores, order, axis=1), np.take_along_axis(best_ids, order, axis=1)
+
+
+# ==== 过滤表达式：解析 collection_schema.build_filter_expr 生成的子句，转成布尔掩码 ====
+_RANGE = re.compile(r"year (>=|<=) (-?\d+)")
+_IN = re.compile(r"(journal|source) in ")
+_HAS_ABSTRACT = re.compile(r'abstract != ""|has_abstract == true')
+_AND = re.compile(r" and ")
+
+
+# ==== 嵌入式精确检索：内存映射的向量矩阵 + pmid 数组，分块矩阵乘 + argpartition ====
+class ExactSearchIndex:
+    def __init__(self, base_path: str = EXACT_SNAPSHOT):
+        self.base_path = base_path
+        records, self.vectors = read_sidecar(base_path)  # 向量为内存映射，只有 pmid 与元数据常驻内存
+        self.pmids = np.asarray([r["pmid"] for r in records])
+        self.rows = {r["pmid"]: i for i, r in enumerate(records)}
+        self.records = records
+        self.years = np.asarray([int(r.get("year") or 0) for r in records], dtype=np.int32)
+        self.columns = {f: np.asarray([r.get(f) or "" for r in records], dtype=object) for f in ("journal", "source")}
+        self.has_abstract = np.asarray([bool(r.get("abstract")) for r in records])
+        # 预先算好每行的范数，检索时不必把整块向量归一化后再写回
+        self.norms = np.concatenate([
+            np.maximum(np.linalg.norm(np.asarray(self.vectors[s:s + EXACT_BLOCK], dtype=np.float32), axis=1), 1e-12)
+            for s in range(0, len(self.vectors), EXACT_BLOCK)
+        ]) if len(self.vectors) else np.zeros(0, dtype=np.float32)
+        self._pool = ThreadPoolExecutor(max_workers=EXACT_THREADS)
+        print(f"📐 已加载精确检索快照: {len(records)} 条（{self.vectors.dtype}）← {base_path}")
+
+    def mask(self, filter_expr: str) -> Optional[np.ndarray]:
+        if not filter_expr:
+            return None
+        mask = np.ones(len(self.pmids), dtype=bool)
+        pos = 0
+        while pos < len(filter_expr):
+            if m := _RANGE.match(filter_expr, pos):
+                year = int(m.group(2))
+                mask &= self.years >= year if m.group(1) == ">=" else self.years <= year
+                pos = m.end()
+            elif m := _IN.match(filter_expr, pos):
+                values, pos = json.JSONDecoder().raw_decode(filter_expr, m.end())
+                mask &= np.isin(self.columns[m.group(1)], values)
+            elif m := _HAS_ABSTRACT.match(filter_expr, pos):
+                mask &= self.has_abstract
+                pos = m.end()
+            else:
+                raise ValueError(f"精确检索不支持的过滤条件: {filter_expr[pos:]}")
+            if m := _AND.match(filter_expr, pos):
+                pos = m.end()
+        return mask
+
+    def _search_block(self, queries: np.ndarray, start: int, k: int,
+                      mask: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        end = min(start + EXACT_BLOCK, len(self.vectors))
+        chunk = np.asarray(self.vectors[start:end], dtype=np.float32)  # float16 快照按块转换后走 BLAS
+        scores = (queries @ chunk.T) / self.norms[start:end]
+        if mask is not None:
+            scores[:, ~mask[start:end]] = -np.inf
+        return merge_top_k(*empty_top_k(len(queries)), scores, np.arange(start, end), k)
+
+    def search(self, query_vectors: Sequence[Sequence[float]], limit: int, filter_expr: str = "",
+               min_score: Optional[float] = None) -> List[List[Dict]]:
+        queries = normalize(np.asarray(query_vectors, dtype=np.float32))
+        mask = self.mask(filter_expr)
+        # 各块在线程池中并行计算（矩阵乘释放 GIL），最后合并各块的 top-k
+        blocks = self._pool.map(lambda s: self._search_block(queries, s, limit, mask),
+                                range(0, len(self.vectors), EXACT_BLOCK))
+        best_scores, best_ids = empty_top_k(len(queries))
+        for scores, ids in blocks:
+            best_scores, best_ids = merge_top_k(best_scores, best_ids, scores, ids, limit)
+        best_scores, best_ids = sort_top_k(best_scores, best_ids)
+        threshold = -np.inf if min_score is None else min_score
+        return [[{"pmid": str(self.pmids[i]), "score": float(s)} for s, i in zip(row_scores, row_ids)
+                 if np.isfinite(s) and s >= threshold]
+                for row_scores, row_ids in zip(best_scores, best_ids)]
+
+    def fetch(self, pmids: Sequence[str], fields: Sequence[str]) -> Dict[str, Dict]:
+        rows = {}
+        for pmid in dict.fromkeys(pmids):
+            i = self.rows.get(pmid)
+            if i is None:
+                continue
+            record = self.records[i]
+            rows[pmid] = {"pmid": pmid, **{f: (np.asarray(self.vectors[i], dtype=np.float32) if f == VECTOR_FIELD
+                                                else record.get(f)) for f in fields}}
+        return rows
+
+
+_index_state = {"mtime": None, "index": None}
+_index_lock = threading.Lock()
+
+
+def get_exact_index(base_path: str = EXACT_SNAPSHOT) -> Optional[ExactSearchIndex]:
+    # 快照不存在时返回 None；重新导出（文件更新）后自动重新加载
+    vector_path = sidecar_paths(base_path)[1]
+    if not base_path or not os.path.exists(vector_path):
+        return None
+    mtime = os.path.getmtime(vector_path)
+    with _index_lock:
+        if _index_state["mtime"] != mtime:
+            _index_state.update(mtime=mtime, index=ExactSearchIndex(base_path))
+    return _index_state["index"]
+
+
+# ==== 导出快照：从集合流式拉取全部元数据与向量 ====
+def export_snapshot(collection: Collection, base_path: str = EXACT_SNAPSHOT,
+                    dtype: np.dtype = sidecar_dtype(VECTOR_DTYPE)):
+    names = {f.name for f in collection.schema.fields}
+    from_doc_store = lean_fields(names)  # 精简 schema 的正文从本地文档库补齐
+    vector_dtype = vector_dtype_of(collection)
+    print(f"📤 正在导出 {collection.num_entities} 条记录 → {base_path}（{np.dtype(dtype).name}）")
+    records, blocks = [], []
+    iterator = collection.query_iterator(batch_size=EXPORT_BATCH,
+                                         output_fields=[f for f in OUTPUT_FIELDS if f in names] + [VECTOR_FIELD])
+    while True:
+        rows = iterator.next()
+        if not rows:
+            break
+        docs = hydrate_rows({}, [row["pmid"] for row in rows], from_doc_store)
+        records.extend({f: {**row, **docs.get(row["pmid"], {})}.get(f, "") for f in OUTPUT_FIELDS} for row in rows)
+        blocks.append(np.stack([decode_vector(row[VECTOR_FIELD], vector_dtype) for row in rows]).astype(dtype))
+    iterator.close()
+    os.makedirs(os.path.dirname(os.path.abspath(base_path)), exist_ok=True)
+    write_sidecar(base_path, records, np.concatenate(blocks) if blocks else np.zeros((0, 0)), dtype=dtype)
+    print(f"✅ 快照已写入 {base_path}.npy，共 {len(records)} 条")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="导出精确检索快照：Milvus 不可用时检索服务自动切换到该快照")
+    parser.add_argument("--uri", default=os.getenv("MILVUS_URI", "http://localhost:19530"),
+                        help="Milvus 地址，或 Milvus Lite 的 .db 文件")
+    parser.add_argument("--collection", default=os.getenv("COLLECTION_NAME", "pubmed_rare_disease_db"))
+    parser.add_argument("--output", default=EXACT_SNAPSHOT, help="快照路径（不含扩展名）")
+    parser.add_argument("--dtype", default=sidecar_dtype(VECTOR_DTYPE).name, choices=["float32", "float16"],
+                        help="快照向量精度，float16 体积减半")
+    args = parser.parse_args()
+
+    connections.connect("default", uri=args.uri)
+    collection = Collection(args.collection)
+    collection.load()
+    export_snapshot(collection, args.output, np.dtype(args.dtype))
@@ -0,0 +1,103 @@
+import os
+import json
+import time
+from typing import Dict, Optional
+from pymilvus import Collection, utility
+from dotenv import find_dotenv, load_dotenv
+
+# ==== 配置 ====
+load_dotenv(find_dotenv(usecwd=True))
+INDEX_PROFILE = os.getenv("INDEX_PROFILE", "ivf_flat")
+# 可选的 JSON 覆盖，例如 INDEX_BUILD_PARAMS='{"nlist": 2048}'、INDEX_SEARCH_PARAMS='{"nprobe": 64}'
+INDEX_BUILD_PARAMS = os.getenv("INDEX_BUILD_PARAMS", "")
+INDEX_SEARCH_PARAMS = os.getenv("INDEX_SEARCH_PARAMS", "")
+METRIC_TYPE = "COSINE"
+VECTOR_FIELD = "embedding"
+
+# ==== 索引档位：构建参数与对应的检索参数成对维护 ====
+# ivf_flat  原始向量，召回稳定，内存 = 原始大小
+# hnsw      图索引，延迟最低，内存比原始略大
+# ivf_sq8   标量量化，内存约为原始的 1/4
+# ivf_pq    乘积量化，内存最省（1024 维 m=64 时约 1/64），召回有损
+# diskann   向量放磁盘，需要 docker-compose 部署的 Milvus（Lite 不支持）
+INDEX_PROFILES: Dict[str, Dict] = {
+    "ivf_flat": {
+        "index_type": "IVF_FLAT",
+        "params": {"nlist": 128},
+        "search_params": {"nprobe": 16},
+    },
+    "hnsw": {
+        "index_type": "HNSW",
+        "params": {"M": 16, "efConstruction": 200},
+        "search_params": {"ef": 64},
+    },
+    "ivf_sq8": {
+        "index_type": "IVF_SQ8",
+        "params": {"nlist": 1024},
+        "search_params": {"nprobe": 32},
+    },
+    "ivf_pq": {
+        "index_type": "IVF_PQ",
+        "params": {"nlist": 1024, "m": 64, "nbits": 8},
+        "search_params": {"nprobe": 32},
+    },
+    "diskann": {
+        "index_type": "DISKANN",
+        "params": {},
+        "search_params": {"search_list": 100},
+    },
+}
+
+
+# 带粗排字段的集合：ANN 检索走低维字段，完整向量只在重排时按主键读取
+# 因此完整向量只建最小的 FLAT 索引（无额外结构），并且索引同样内存映射，不常驻内存
+RESCORE_INDEX_PARAMS = {"index_type": "FLAT", "metric_type": METRIC_TYPE, "params": {"mmap.enabled": "true"}}
+
+
+def _override(raw: str) -> Dict:
+    return json.loads(raw) if raw else {}
+
+
+def get_profile(name: Optional[str] = None) -> Dict:
+    name = (name or INDEX_PROFILE).lower()
+    if name not in INDEX_PROFILES:
+        raise ValueError(f"Unknown index profile: {name} (available: {', '.join(INDEX_PROFILES)})")
+    return INDEX_PROFILES[name]
+
+
+def get_index_params(name: Optional[str] = None) -> Dict:
+    profile = get_profile(name)
+    return {
+        "index_type": profile["index_type"],
+        "metric_type": METRIC_TYPE,
+        "params": {**profile["params"], **_override(INDEX_BUILD_PARAMS)},
+    }
+
+
+def get_search_params(name: Optional[str] = None, **overrides) -> Dict:
+    profile = get_profile(name)
+    return {
+        "metric_type": METRIC_TYPE,
+        "params": {**profile["search_params"], **_override(INDEX_SEARCH_PARAMS), **overrides},
+    }
+
+
+# ==== 向量索引的删除 / 重建（批量导入与索引迁移共用） ====
+def drop_vector_index(collection: Collection, field: str = VECTOR_FIELD) -> Optional[Dict]:
+    collection.release()
+    for index in collection.indexes:
+        if index.field_name == field:
+            params = dict(index.params)
+            collection.drop_index(index_name=index.index_name)
+            print(f"🧹 已删除向量索引: {params}")
+            return params
+    return None
+
+
+def build_vector_index(collection: Collection, index_params: Dict, field: str = VECTOR_FIELD):
+    print(f"🏗️ 正在重建向量索引: {index_params}")
+    started = time.perf_counter()
+    collection.create_index(field_name=field, index_params=index_params, index_name=field)
+    utility.wait_for_index_building_complete(collection.name, index_name=field)
+    collection.load()
+    print(f"✅ 索引重建完成并已加载，用时 {time.perf_counter() - started:.0f}s")
@@ -0,0 +1,60 @@
+import os
+import argparse
+from typing import Optional
+from pymilvus import connections, Collection
+from dotenv import load_dotenv
+from collection_schema import PARTITION_UNKNOWN, is_year_partition, partitions_for_range
+from query_cache import bump_collection_generation
+
+# ==== 配置 ====
+load_dotenv()
+COLLECTION_NAME = os.getenv("COLLECTION_NAME", "pubmed_rare_disease_db")
+
+
+def list_partitions(collection: Collection):
+    for partition in sorted(collection.partitions, key=lambda p: p.name):
+        if partition.name == "_default" and partition.num_entities == 0:
+            continue
+        print(f"  {partition.name:<12} {partition.num_entities:>8} 篇")
+
+
+# ==== 释放 / 加载年份分区：冷门的旧年份不占内存，需要时再加载 ====
+def release_before(collection: Collection, year: int):
+    names = [p.name for p in collection.partitions if is_year_partition(p.name)]
+    newer = set(partitions_for_range(names, year_from=year))
+    old = [name for name in names if name not in newer and name != PARTITION_UNKNOWN]
+    if not old:
+        print("✅ 没有需要释放的分区")
+        return
+    for name in old:
+        collection.partition(name).release()  # 按分区释放需要 docker-compose 部署的 Milvus，Lite 不支持
+    bump_collection_generation(collection.name)  # 通知检索服务刷新可检索的分区列表
+    print(f"🧊 已释放 {len(old)} 个分区: {', '.join(sorted(old))}")
+
+
+def load_from(collection: Collection, year: Optional[int] = None):
+    names = [p.name for p in collection.partitions]
+    selected = partitions_for_range(names, year_from=year) if year is not None else names
+    collection.load(partition_names=selected)
+    bump_collection_generation(collection.name)
+    print(f"🔥 已加载 {len(selected)} 个分区")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="查看 / 释放 / 加载按年份划分的分区")
+    parser.add_argument("action", choices=["list", "release", "load"])
+    parser.add_argument("--before", type=int, help="release：释放早于该年份的分区")
+    parser.add_argument("--from-year", type=int, help="load：加载该年份及之后的分区（不填则全部加载）")
+    parser.add_argument("--collection", default=COLLECTION_NAME)
+    args = parser.parse_args()
+
+    connections.connect("default", host="localhost", port="19530")
+    collection = Collection(args.collection)
+    if args.action == "list":
+        list_partitions(collection)
+    elif args.action == "release":
+        if args.before is None:
+            parser.error("release 需要 --before")
+        release_before(collection, args.before)
+    else:
+        load_from(collection, args.from_year)
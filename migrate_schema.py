@@ -0,0 +1,173 @@
+import os
+import json
+import argparse
+from typing import List
+import numpy as np
+from pymilvus import connections, utility, Collection
+from tqdm import tqdm
+from dotenv import load_dotenv
+from benchmark_search import recall_at_k
+from coarse_vectors import COARSE_FIELD, COARSE_OVERFETCH, COARSE_SCHEMA, load_projection, rescore
+from collection_schema import (
+    INPUT_FIELDS, LEAN_SCHEMA, coarse_dim_of, create_coarse_index, create_collection, create_scalar_indexes,
+    create_sparse_indexes, parse_year, vector_dtype_of, vector_index_params, write_by_partition
+)
+from doc_store import hydrate_rows, lean_fields
+from exact_search import empty_top_k, merge_top_k, normalize, sort_top_k
+from index_profiles import VECTOR_FIELD, build_vector_index, get_search_params
+from query_cache import bump_collection_generation
+from vector_codec import VECTOR_DATA_TYPES, VECTOR_DTYPE, decode_vector, encode_queries
+
+# ==== 配置 ====
+load_dotenv()
+COLLECTION_NAME = os.getenv("COLLECTION_NAME", "pubmed_rare_disease_db")
+COPY_BATCH = 1000
+RECALL_QUERIES = 200  # 复制时抽样的查询向量条数，用于比较迁移前后的召回率
+RECALL_K = 10
+RECALL_NOISE = 0.01
+
+
+# ==== 召回率对比：以 float32 原始向量的暴力检索为真值，分别检索迁移前后的集合 ====
+def exact_truth(source: Collection, queries: np.ndarray, k: int) -> List[List[str]]:
+    # 再流式读一遍源集合（只取 pmid + 向量），逐批并入 top-k，不把整个底库放进内存
+    source_dtype = vector_dtype_of(source)
+    best_scores, best_ids = empty_top_k(len(queries))
+    pmids: List[str] = []
+    iterator = source.query_iterator(batch_size=COPY_BATCH, output_fields=["pmid", VECTOR_FIELD])
+    while True:
+        rows = iterator.next()
+        if not rows:
+            break
+        chunk = normalize(np.stack([decode_vector(row[VECTOR_FIELD], source_dtype) for row in rows]))
+        best_scores, best_ids = merge_top_k(best_scores, best_ids, queries @ chunk.T,
+                                            np.arange(len(pmids), len(pmids) + len(chunk)), k)
+        pmids.extend(row["pmid"] for row in rows)
+    iterator.close()
+    return [[pmids[i] for i in row] for row in sort_top_k(best_scores, best_ids)[1]]
+
+
+def search_pmids(collection: Collection, queries: np.ndarray, k: int) -> List[List[str]]:
+    data = encode_queries(queries, vector_dtype_of(collection))
+    results = []
+    for start in range(0, len(data), 50):
+        hits = collection.search(data[start:start + 50], VECTOR_FIELD, get_search_params(), limit=k)
+        results.extend([[str(hit.id) for hit in query_hits] for query_hits in hits])
+    return results
+
+
+def search_pmids_coarse(collection: Collection, queries: np.ndarray, k: int,
+                        overfetch: int = COARSE_OVERFETCH) -> List[List[str]]:
+    # 粗排字段召回 k × overfetch 条候选，再取完整向量精确重排（与检索服务的粗排路径一致）
+    low = load_projection(coarse_dim_of(collection)).project(queries)
+    vector_dtype = vector_dtype_of(collection)
+    results = []
+    for query, query_low in zip(queries, low):
+        hits = collection.search([query_low], COARSE_FIELD, get_search_params(), limit=k * overfetch)[0]
+        rows = collection.query(f"pmid in {json.dumps([str(hit.id) for hit in hits])}",
+                                output_fields=["pmid", VECTOR_FIELD])
+        if not rows:
+            results.append([])
+            continue
+        scores = rescore(query, np.stack([decode_vector(row[VECTOR_FIELD], vector_dtype) for row in rows]))
+        results.append([rows[i]["pmid"] for i in np.argsort(-scores)[:k]])
+    return results
+
+
+def report_recall(source: Collection, target: Collection, queries: np.ndarray, k: int = RECALL_K):
+    queries = normalize(queries)
+    truth = exact_truth(source, queries, k)
+    before = recall_at_k(search_pmids(source, queries, k), truth, k)
+    after = recall_at_k(search_pmids(target, queries, k), truth, k)
+    print(f"🎯 recall@{k}（{len(queries)} 条抽样查询）: 迁移前 {before:.4f} → 迁移后 {after:.4f}（{after - before:+.4f}）")
+    if coarse_dim_of(target):
+        coarse = recall_at_k(search_pmids_coarse(target, queries, k), truth, k)
+        print(f"🎯 粗排 + 重排 recall@{k}（候选 {k} × {COARSE_OVERFETCH}）: {coarse:.4f}")
+
+
+# ==== schema 迁移：year VARCHAR → INT16、补上标量索引与 BM25 稀疏字段、按年份分区，可同时改变向量存储类型 ====
+# Milvus 不支持原地修改字段类型，因此复制到新集合后互换名称，旧集合保留为 <name>_backup
+def migrate_collection(name: str, drop_old: bool = False, vector_dtype: str = VECTOR_DTYPE, dry_run: bool = False,
+                       lean: bool = LEAN_SCHEMA, coarse: bool = COARSE_SCHEMA):
+    source = Collection(name)
+    source.load()
+    source_dtype = vector_dtype_of(source)
+    source_names = {f.name for f in source.schema.fields}
+    from_doc_store = lean_fields(source_names)  # 源集合为精简 schema 时，正文从本地文档库读取
+    target_name = f"{name}_migrating"
+    if utility.has_collection(target_name):
+        utility.drop_collection(target_name)  # 上次中断留下的半成品
+    dim = next(f for f in source.schema.fields if f.name == VECTOR_FIELD).params["dim"]
+    target = create_collection(target_name, dim=dim, with_indexes=False, vector_dtype=vector_dtype, lean=lean,
+                               coarse=coarse)
+
+    print(f"📦 复制 {source.num_entities} 条记录: {name} → {target_name}（向量 {source_dtype} → {vector_dtype}）")
+    rng = np.random.default_rng(42)
+    sample_rate = min(1.0, RECALL_QUERIES / max(source.num_entities, 1))
+    samples: List[np.ndarray] = []
+    iterator = source.query_iterator(batch_size=COPY_BATCH,
+                                     output_fields=[f for f in INPUT_FIELDS if f in source_names])
+    progress = tqdm(total=source.num_entities, unit="篇")
+    while True:
+        rows = iterator.next()
+        if not rows:
+            break
+        if from_doc_store:
+            docs = hydrate_rows({}, [row["pmid"] for row in rows], from_doc_store)
+            rows = [{**row, **docs[row["pmid"]]} for row in rows]
+        years = [parse_year(row["year"]) for row in rows]
+        columns = [[row[f] for row in rows] for f in INPUT_FIELDS]
+        columns[INPUT_FIELDS.index("year")] = years
+        if source_dtype != "float32":
+            columns[-1] = [decode_vector(v, source_dtype) for v in columns[-1]]  # 半精度源集合先解码，写入时再按新类型编码
+        write_by_partition(target, columns, years)  # 新集合按年份分区
+        picked = np.flatnonzero(rng.random(len(rows)) < sample_rate)
+        samples.extend(np.asarray(columns[-1][i], dtype=np.float32) for i in picked)
+        progress.update(len(rows))
+    iterator.close()
+    progress.close()
+    target.flush()
+
+    # 数据就位后再建索引，IVF 聚类中心基于真实数据训练
+    create_scalar_indexes(target)
+    create_sparse_indexes(target)
+    create_coarse_index(target)
+    build_vector_index(target, vector_index_params(target))  # 有粗排字段时完整向量只建 FLAT
+
+    if samples:
+        queries = np.stack(samples[:RECALL_QUERIES])
+        report_recall(source, target, queries + rng.normal(0, RECALL_NOISE, queries.shape).astype(np.float32))
+    if dry_run:
+        utility.drop_collection(target_name)
+        print(f"🧪 dry run：已删除 {target_name}，{name} 保持不变")
+        return
+
+    backup_name = f"{name}_backup"
+    source.release()
+    if utility.has_collection(backup_name):
+        utility.drop_collection(backup_name)
+    utility.rename_collection(name, backup_name)
+    utility.rename_collection(target_name, name)
+    Collection(name).load()
+    bump_collection_generation(name)  # 使 MCP Server 的检索结果缓存失效
+    print(f"✅ 迁移完成：{name} 已切换为新 schema，旧数据保留在 {backup_name}")
+    if drop_old:
+        utility.drop_collection(backup_name)
+        print(f"🧹 已删除 {backup_name}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="迁移集合 schema：year 改为整数、创建 year/journal/source 标量索引并按年份分区")
+    parser.add_argument("--collection", default=COLLECTION_NAME)
+    parser.add_argument("--drop-old", action="store_true", help="迁移成功后删除旧集合（默认保留为 <name>_backup）")
+    parser.add_argument("--vector-dtype", default=VECTOR_DTYPE, choices=list(VECTOR_DATA_TYPES),
+                        help="新集合的向量存储类型（默认取 VECTOR_DTYPE）；float16 / bfloat16 向量内存减半")
+    parser.add_argument("--dry-run", action="store_true", help="只复制并报告召回率变化，不切换集合")
+    parser.add_argument("--lean", action="store_true",
+                        help="新集合使用精简 schema：abstract / authors 移到本地文档库（默认取 LEAN_SCHEMA）")
+    parser.add_argument("--coarse", action="store_true",
+                        help="新集合带低维粗排字段（投影见 coarse_vectors.py，默认取 COARSE_SCHEMA）")
+    args = parser.parse_args()
+
+    connections.connect("default", host="localhost", port="19530")
+    migrate_collection(args.collection, drop_old=args.drop_old, vector_dtype=args.vector_dtype, dry_run=args.dry_run,
+                       lean=args.lean or LEAN_SCHEMA, coarse=args.coarse or COARSE_SCHEMA)
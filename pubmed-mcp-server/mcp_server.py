@@ -4,70 +4,155 @@ MCP Server for PubMed Vector Search using FastMCP + httpx
 """
 
 from fastmcp import FastMCP
-import httpx
 import os
-from typing import List, Dict, Any
+import asyncio
+import sys
+from typing import List, Dict, Any, Optional
 from dotenv import load_dotenv
-from search_pubmed_by_query import search_pubmed_by_query 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # 复用仓库根目录的共享模块
+from collection_schema import build_filter_expr
+from search_pubmed_by_query import (
+    FUSION_METHODS, HYBRID_FUSION, SEARCH_MODES, is_lean_collection, query_embedding_cache, search_result_cache,
+    search_pubmed_by_queries_async, search_pubmed_by_query_async, select_partitions
+)
+from starlette.requests import Request
+from starlette.responses import JSONResponse
 from datetime import datetime
 
 # 加载 .env 环境变量
 load_dotenv()
+MAX_CONCURRENT_SEARCHES = int(os.getenv("MAX_CONCURRENT_SEARCHES", "16"))  # 同时执行的检索数上限
+MAX_BATCH_QUERIES = int(os.getenv("MAX_BATCH_QUERIES", "20"))                # 批量工具单次最多查询数
+
+# 工具结果只用到这些字段，检索时只按主键拉取它们（两阶段检索）
+RESULT_FIELDS = ["title", "abstract"]
+
+# 限制并发检索，避免瞬时请求压垮 embedding 服务和 Milvus
+search_semaphore = asyncio.Semaphore(MAX_CONCURRENT_SEARCHES)
 
 # 初始化 MCP Server
 server = FastMCP()
 
+# 格式化结构化结果
+def format_results(results: List[Dict]) -> List[Dict]:
+    formatted = []
+    for i, item in enumerate(results, 1):
+        formatted.append({
+            "rank": i,
+            "score": round(item.get("score", 0.0), 3),
+            "pmid": item.get("pmid", ""),
+            "title": item.get("title", ""),
+            # "doi": item.get("doi", ""),
+            # "authors": item.get("authors", []),
+            # "journal": item.get("journal", ""),
+            # "year": item.get("year", ""),
+            "abstract": item.get("abstract", "")
+        })
+    return formatted
+
+# 构造清晰的自然语言摘要
+def build_summary(query: str, formatted: List[Dict]) -> str:
+    summary_lines = [f"PubMed 检索关键词：{query}\n"]
+    for i, item in enumerate(formatted, 1):
+        summary_lines.append(f"{i}.《{item['title']}》")
+        # summary_lines.append(f"  期刊: {item['journal']}（{item['year']}）")
+        summary_lines.append(f"  PMID: {item['pmid']}")
+        if item['abstract']:
+            summary_lines.append(f" 摘要: {item['abstract']}" )
+        summary_lines.append("")  # 空行分隔
+    return "\n".join(summary_lines).strip()
+
+# 跨查询去重：同一 PMID 只保留在得分最高的那条查询下
+# by_rank 为 True 时（sparse / hybrid 的融合分数在不同查询之间不可比）改为保留在名次最靠前的那条查询下
+def dedupe_across_queries(grouped: List[List[Dict]], by_rank: bool = False) -> List[List[Dict]]:
+    best = {}
+    for qi, results in enumerate(grouped):
+        for rank, item in enumerate(results):
+            pmid = item["pmid"]
+            key = -rank if by_rank else item["score"]
+            if pmid not in best or key > best[pmid][1]:
+                best[pmid] = (qi, key)
+    return [[item for item in results if best[item["pmid"]][0] == qi] for qi, results in enumerate(grouped)]
+
+# 校验检索模式与融合方式
+def check_mode(mode: str, fusion: str):
+    if mode not in SEARCH_MODES:
+        raise Exception(f"mode 只能是 {' / '.join(SEARCH_MODES)}")
+    if fusion not in FUSION_METHODS:
+        raise Exception(f"fusion 只能是 {' / '.join(FUSION_METHODS)}")
+
+def check_diversity(diversity: float):
+    if not 0 <= diversity <= 1:
+        raise Exception("diversity 取值范围为 0 ~ 1")
+
+# sparse 模式没有向量相似度，socre 阈值不起作用
+def effective_min_score(mode: str, socre: Optional[float]) -> Optional[float]:
+    return None if mode == "sparse" else socre
+
+# 返回结果中 score 的含义：dense 为余弦相似度，sparse / hybrid 为 rrf / weighted 融合分数
+def score_type(mode: str, fusion: str) -> str:
+    return "cosine" if mode == "dense" else fusion
+
 @server.tool()
 async def search_pubmed_vector(
     query: str,
     top_k: int = 5,
-    socre: float = 0.6,
+    socre: Optional[float] = 0.6,
+    year_from: Optional[int] = None,
+    year_to: Optional[int] = None,
+    journals: Optional[List[str]] = None,
+    has_abstract: bool = False,
+    mode: str = "dense",
+    fusion: str = HYBRID_FUSION,
+    diversity: float = 0.0,
 ) -> Dict[str, Any]:
     """
     从本地 Milvus 向量数据库中检索 PubMed 相关文献
 
     Args:
         query: 查询字符串，支持疾病、药物、症状、基因等
-        top_k: 返回前多少个结果（默认5）
+        top_k: 最多返回多少个结果（默认5）
+        socre: 相似度阈值（默认0.6），只返回余弦相似度不低于（>=）该阈值的文献；为 null 时不设阈值。
+               hybrid 模式只作用于向量这一路，sparse 模式下不生效
+        year_from: 只返回该年份及之后发表的文献，如 2023
+        year_to: 只返回该年份及之前发表的文献
+        journals: 只返回这些期刊的文献（期刊全名）
+        has_abstract: 为 True 时只返回有摘要的文献
+        mode: dense 语义向量检索（默认）；sparse 关键词（BM25）检索；hybrid 两者融合，适合基因名、药物编号等精确术语
+        fusion: hybrid / sparse 的融合方式，rrf（按名次）或 weighted（按加权分数）
+        diversity: 结果多样性（0~1，默认0 不处理）；大于0 时合并标题 / DOI 重复的文献，并用 MMR 挑选彼此不同的结果，
+                   如 0.3 适合需要多方面证据的问题
 
     Returns:
-        包含自然语言摘要（text）和结构化检索结果（json）
+        包含自然语言摘要（text）和结构化检索结果（json）。dense 模式下 score 为余弦相似度；
+        sparse / hybrid 模式下 score 为融合分数（见 metadata.score_type），不能与 socre 比较
     """
 
     if not query:
         raise Exception("请提供有效的查询关键词")
+    check_mode(mode, fusion)
+    check_diversity(diversity)
+    min_score = effective_min_score(mode, socre)
 
     try:
-        # 调用已有检索函数
-        results = search_pubmed_by_query(query=query, top_k=top_k)
-
-        # 格式化结构化结果
-        formatted = []
-        for i, item in enumerate(results, 1):
-            if item.get("score", 0) >= socre:
-                formatted.append({
-                    "rank": i,
-                    "score": round(item.get("score", 0.0), 3),
-                    "pmid": item.get("pmid", ""),
-                    "title": item.get("title", ""),
-                    # "doi": item.get("doi", ""),
-                    # "authors": item.get("authors", []),
-                    # "journal": item.get("journal", ""),
-                    # "year": item.get("year", ""),
-                    "abstract": item.get("abstract", "")
-                })
-
-        # 构造清晰的自然语言摘要
-        summary_lines = [f"PubMed 检索关键词：{query}\n"]
-        for i, item in enumerate(formatted, 1):
-            summary_lines.append(f"{i}.《{item['title']}》")
-            # summary_lines.append(f"  期刊: {item['journal']}（{item['year']}）")
-            summary_lines.append(f"  PMID: {item['pmid']}")
-            if item['abstract']:
-                summary_lines.append(f" 摘要: {item['abstract']}" )
-            summary_lines.append("")  # 空行分隔
-
-        text_summary = "\n".join(summary_lines).strip()
+        # 过滤条件下推到 Milvus，一次检索即得到满足条件的 top_k
+        lean = await asyncio.to_thread(is_lean_collection)  # 精简 schema 用 has_abstract 字段过滤
+        filter_expr = build_filter_expr(year_from=year_from, year_to=year_to, journals=journals,
+                                        has_abstract=has_abstract, lean=lean)
+
+        # 按年份分区的集合只扫描与年份范围相交的分区
+        partition_names = await asyncio.to_thread(select_partitions, year_from, year_to)
+
+        # 异步检索：等待 embedding / Milvus 期间不阻塞其他客户端
+        async with search_semaphore:
+            # 阈值以 range search 下推到 Milvus：低于 socre 的命中不会被返回和传输
+            results = await search_pubmed_by_query_async(query=query, top_k=top_k, filter_expr=filter_expr,
+                                                         partition_names=partition_names, min_score=min_score,
+                                                         output_fields=RESULT_FIELDS, mode=mode, fusion=fusion,
+                                                         diversity=diversity)
+
+        formatted = format_results(results)
+        text_summary = build_summary(query, formatted)
 
         return {"query": query,
                 "result": formatted,
@@ -76,6 +161,12 @@ async def search_pubmed_vector(
                                 "source": "local_pubmed_vector_db",
                                 "retrieved_at": datetime.now(),
                                 "top_k": top_k,
+                                "min_score": min_score,
+                                "score_type": score_type(mode, fusion),
+                                "filter": filter_expr,
+                                "mode": mode,
+                                "fusion": fusion if mode != "dense" else None,
+                                "diversity": diversity,
                                 "tool": "search_pubmed_vector"
                             }
                 }  # 给 LLM 使用
@@ -84,6 +175,93 @@ async def search_pubmed_vector(
     except Exception as e:
         raise Exception(f"文献检索失败: {str(e)}")
 
+@server.tool()
+async def search_pubmed_vector_batch(
+    queries: List[str],
+    top_k: int = 5,
+    socre: Optional[float] = 0.6,
+    year_from: Optional[int] = None,
+    year_to: Optional[int] = None,
+    journals: Optional[List[str]] = None,
+    has_abstract: bool = False,
+    dedupe: bool = False,
+    mode: str = "dense",
+    fusion: str = HYBRID_FUSION,
+    diversity: float = 0.0,
+) -> Dict[str, Any]:
+    """
+    一次检索多条查询（如同一轮中的多个子问题），结果按查询分组返回
+
+    Args:
+        queries: 查询字符串列表
+        top_k: 每条查询最多返回多少个结果（默认5）
+        socre: 相似度阈值（默认0.6），同 search_pubmed_vector
+        year_from / year_to / journals / has_abstract: 同 search_pubmed_vector，对所有查询生效
+        dedupe: 为 True 时同一篇文献只出现在得分最高的那条查询下（sparse / hybrid 模式按名次比较）
+        mode / fusion / diversity: 同 search_pubmed_vector
+
+    Returns:
+        每条查询的结构化结果（results）与合并的自然语言摘要（text）；score 的含义同 search_pubmed_vector
+    """
+
+    queries = [q for q in queries if q and q.strip()]
+    if not queries:
+        raise Exception("请提供有效的查询关键词")
+    if len(queries) > MAX_BATCH_QUERIES:
+        raise Exception(f"单次最多 {MAX_BATCH_QUERIES} 条查询")
+    check_mode(mode, fusion)
+    check_diversity(diversity)
+    min_score = effective_min_score(mode, socre)
+
+    try:
+        lean = await asyncio.to_thread(is_lean_collection)  # 精简 schema 用 has_abstract 字段过滤
+        filter_expr = build_filter_expr(year_from=year_from, year_to=year_to, journals=journals,
+                                        has_abstract=has_abstract, lean=lean)
+        partition_names = await asyncio.to_thread(select_partitions, year_from, year_to)
+
+        # 一次 embedding 请求 + 一次多向量 search + 一次按主键 query
+        async with search_semaphore:
+            grouped = await search_pubmed_by_queries_async(queries, top_k=top_k, filter_expr=filter_expr,
+                                                           partition_names=partition_names, min_score=min_score,
+                                                           output_fields=RESULT_FIELDS, mode=mode, fusion=fusion,
+                                                           diversity=diversity)
+        if dedupe:
+            grouped = dedupe_across_queries(grouped, by_rank=mode != "dense")
+
+        per_query = []
+        for query, results in zip(queries, grouped):
+            formatted = format_results(results)
+            per_query.append({"query": query, "result": formatted, "text": build_summary(query, formatted)})
+
+        return {"queries": queries,
+                "results": [{"query": q["query"], "result": q["result"]} for q in per_query],
+                "text": "\n\n".join(q["text"] for q in per_query),
+                "metadata": {
+                                "source": "local_pubmed_vector_db",
+                                "retrieved_at": datetime.now(),
+                                "top_k": top_k,
+                                "min_score": min_score,
+                                "score_type": score_type(mode, fusion),
+                                "filter": filter_expr,
+                                "dedupe": dedupe,
+                                "mode": mode,
+                                "fusion": fusion if mode != "dense" else None,
+                                "diversity": diversity,
+                                "tool": "search_pubmed_vector_batch"
+                            }
+                }
+
+    except Exception as e:
+        raise Exception(f"批量文献检索失败: {str(e)}")
+
+# 缓存命中率等运维指标（普通 HTTP 接口，不暴露给 LLM）
+@server.custom_route("/cache/stats", methods=["GET"])
+async def cache_stats(request: Request) -> JSONResponse:
+    return JSONResponse({
+        "query_embedding": query_embedding_cache.stats(),
+        "search_result": search_result_cache.stats(),
+    })
+
 # 启动 FastMCP Server（使用 HTTP 接口）
 if __name__ == "__main__":
     server.run(transport="http", host="0.0.0.0", port=8035)
@@ -1,74 +1,497 @@
 import os
-from pymilvus import MilvusClient
-from typing import List, Dict
-import requests
+import sys
+import json
+import time
+import asyncio
+import grpc
+import numpy as np
+from pymilvus import AnnSearchRequest, MilvusClient, MilvusException, RRFRanker, WeightedRanker
+from pymilvus.client.types import Status
+from pymilvus.exceptions import MilvusUnavailableException
+from typing import List, Dict, Optional
 from dotenv import load_dotenv
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # 复用仓库根目录的共享模块
+from coarse_vectors import COARSE_FIELD, COARSE_OVERFETCH, load_projection, rescore
+from embedding_client import EMBEDDING_MODEL, AsyncEmbeddingClient, get_embedding
+from collection_schema import OUTPUT_FIELDS, SPARSE_FIELDS, is_year_partitioned, partitions_for_range, sparse_fields_in
+from doc_store import hydrate_rows, lean_fields
+from exact_search import get_exact_index
+from index_profiles import VECTOR_FIELD, get_search_params
+from query_cache import QueryEmbeddingCache, SearchResultCache, read_collection_generation
+from rerank import collapse_duplicates, mmr_select, rrf_fuse, weighted_fuse
+from vector_codec import decode_vector, dtype_of, encode_queries
+
 # ==== 配置 ====
 load_dotenv()
 MILVUS_URI = os.getenv("MILVUS_URI")
 COLLECTION_NAME = os.getenv("COLLECTION_NAME")
-EMBEDDING_DIM = 1024
-EMBEDDING_API_URL = os.getenv("EMBEDDING_API_URL")
-EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL")
-
-# ==== 初始化客户端 ====
-client = MilvusClient(uri=MILVUS_URI)
-
-# ==== 生成 embedding ====
-def get_embedding(text: str) -> List[float]:
-    payload = {
-        "input": [text],
-        "model": EMBEDDING_MODEL
-    }
-    response = requests.post(EMBEDDING_API_URL, json=payload)
-    response.raise_for_status()
-    embedding = response.json()["data"][0]["embedding"]
-    if len(embedding) != EMBEDDING_DIM:
-        raise ValueError(f"Embedding dim mismatch: {len(embedding)} != {EMBEDDING_DIM}")
-    return embedding
-
-# ==== Milvus 向量检索 ====
-def search_in_milvus(query_vector: List[float], top_k: int = 5) -> List[Dict]:
+SEARCH_PARAMS = get_search_params()  # 由 INDEX_PROFILE 决定 nprobe / ef 等参数
+RANGE_EPSILON = 1e-6  # range search 的上下界各放宽一点：radius 不含边界，COSINE 也可能因浮点误差略高于 1.0
+# 检索模式：dense 仅向量；sparse 仅 BM25（title + abstract）；hybrid 向量 + BM25 融合
+SEARCH_MODES = ("dense", "sparse", "hybrid")
+FUSION_METHODS = ("rrf", "weighted")
+HYBRID_FUSION = os.getenv("HYBRID_FUSION", "rrf")
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+HYBRID_WEIGHTS = [float(w) for w in os.getenv("HYBRID_WEIGHTS", "0.6,0.2,0.2").split(",")]  # dense, title, abstract
+HYBRID_OVERFETCH = int(os.getenv("HYBRID_OVERFETCH", "3"))  # 每一路召回 top_k × N 条候选再融合
+DIVERSITY_OVERFETCH = int(os.getenv("DIVERSITY_OVERFETCH", "4"))  # diversity > 0 时先取 top_k × N 条候选再做 MMR
+# 检索后端：milvus 为默认，Milvus 出错时自动切换到精确检索快照（exact_search.py 导出）；exact 只用快照，不依赖 Milvus
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "milvus")
+FAILOVER_COOLDOWN = float(os.getenv("FAILOVER_COOLDOWN", "30"))  # 切换后多少秒内不再尝试 Milvus
+# 只有连接失败 / 超时 / 服务不可用才切换到快照；过滤表达式错误等请求本身的问题照常抛给调用方
+FAILOVER_GRPC_CODES = (grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.DEADLINE_EXCEEDED)
+
+# ==== 初始化客户端：首次检索时才连接，Milvus 未启动时服务仍可用快照检索 ====
+_client: Optional[MilvusClient] = None
+_failover = {"until": 0.0}
+
+
+def get_client() -> MilvusClient:
+    global _client
+    if _client is None:
+        _client = MilvusClient(uri=MILVUS_URI)
+    return _client
+
+
+def milvus_available() -> bool:
+    return SEARCH_BACKEND != "exact" and time.monotonic() >= _failover["until"]
+
+
+def is_unavailable(error: BaseException) -> bool:
+    # pymilvus 对 gRPC 错误有时原样抛出，有时包成 MilvusException（原始错误在 __cause__ 中）
+    if isinstance(error, grpc.RpcError):
+        return error.code() in FAILOVER_GRPC_CODES
+    if isinstance(error, MilvusUnavailableException):
+        return True
+    if isinstance(error, MilvusException):
+        return error.code == Status.CONNECT_FAILED or (error.__cause__ is not None
+                                                       and is_unavailable(error.__cause__))
+    return isinstance(error, (ConnectionError, TimeoutError))
+
+
+def fail_over(error: Exception):
+    # 在 except 块中调用：不是连接类错误、或没有快照可用时原样抛出，否则标记 Milvus 不可用
+    if not is_unavailable(error) or get_exact_index() is None:
+        raise error
+    _failover["until"] = time.monotonic() + FAILOVER_COOLDOWN
+    print(f"⚠️ Milvus 不可用，{FAILOVER_COOLDOWN:.0f} 秒内改用精确检索快照: {error}")
+
+# ==== 查询向量缓存：相同/近似相同的查询不再重复调用 embedding 接口 ====
+query_embedding_cache = QueryEmbeddingCache()
+# ==== 检索结果缓存：入库脚本更新 generation 后自动失效 ====
+search_result_cache = SearchResultCache(COLLECTION_NAME)
+
+
+def get_query_embedding(query: str) -> List[float]:
+    return query_embedding_cache.get_or_compute(query, EMBEDDING_MODEL or "", get_embedding)
+
+# ==== 年份分区：缓存已加载的分区列表，入库 / 释放分区后随 generation 一起刷新 ====
+_partition_state = {"generation": None, "loaded": []}
+
+
+def get_loaded_partitions() -> List[str]:
+    generation = read_collection_generation(COLLECTION_NAME)
+    if _partition_state["generation"] != generation:
+        names = get_client().list_partitions(COLLECTION_NAME)
+        loaded = [name for name in names
+                  if get_client().get_load_state(COLLECTION_NAME, partition_name=name)["state"].name == "Loaded"]
+        _partition_state.update(generation=generation, loaded=loaded)
+    return _partition_state["loaded"]
+
+
+def select_partitions(year_from: Optional[int] = None, year_to: Optional[int] = None) -> Optional[List[str]]:
+    # 集合未按年份分区时返回 None（检索整个集合）；否则只返回已加载且与年份范围相交的分区
+    # Milvus 不可用时同样返回 None：快照检索按 filter_expr 中的年份条件过滤
+    if not milvus_available():
+        return None
     try:
-        print(f"🔍 正在 Milvus 中搜索 Top-{top_k} 向量...")
-        search_result = client.search(
+        loaded = get_loaded_partitions()
+    except Exception as e:
+        fail_over(e)
+        return None
+    if not is_year_partitioned(loaded):
+        return None
+    return partitions_for_range(loaded, year_from, year_to)
+
+# ==== 第一阶段：向量检索只取 pmid + score，不传输正文字段 ====
+def search_ids(query_vectors: List[List[float]], top_k: int = 5, filter_expr: str = "",
+               partition_names: Optional[List[str]] = None, min_score: Optional[float] = None,
+               mode: str = "dense", query_texts: Optional[List[str]] = None,
+               fusion: str = HYBRID_FUSION) -> List[List[Dict]]:
+    # filter_expr 为标量过滤表达式（见 collection_schema.build_filter_expr），在 Milvus 内部先过滤再检索
+    # partition_names 为 select_partitions 选出的年份分区，只扫描这些分区
+    # min_score 为相似度阈值：走 range search，只返回 score >= min_score 的结果（最多 top_k 条）
+    #           hybrid 模式下只作用于向量这一路
+    # mode / query_texts / fusion：sparse 与 hybrid 模式需要原始查询文本，融合方式为 rrf 或 weighted
+    search_params = SEARCH_PARAMS
+    if min_score is not None:
+        # COSINE 越大越相似：radius 为下界（不含），range_filter 为上界；上下界都略微放宽，
+        # 保留恰好等于阈值的结果，以及浮点误差下略高于 1.0 的几乎相同的向量
+        search_params = get_search_params(radius=min_score - RANGE_EPSILON, range_filter=1.0 + RANGE_EPSILON)
+    if mode != "dense":
+        return search_hybrid_ids(query_vectors, query_texts or [], top_k, filter_expr, partition_names,
+                                 search_params, mode, fusion)
+    if COARSE_OVERFETCH > 0 and COARSE_FIELD in describe_fields():
+        return search_coarse_ids(query_vectors, top_k, filter_expr, partition_names, min_score)
+    search_result = get_client().search(
+        collection_name=COLLECTION_NAME,
+        data=encode_queries(query_vectors, collection_vector_dtype()),  # 半精度集合的查询向量同样编码
+        anns_field=VECTOR_FIELD,  # 带粗排字段的集合有两个向量字段
+        search_params=search_params,
+        limit=top_k,
+        filter=filter_expr,
+        partition_names=partition_names,
+        output_fields=["pmid"],
+        consistency_level="Bounded"
+    )
+    return to_hits(search_result)
+
+
+def to_hits(search_result) -> List[List[Dict]]:
+    return [[{"pmid": hit["entity"].get("pmid"), "score": hit.get("distance")} for hit in hits]
+            for hits in search_result]
+
+
+# ==== 粗排 + 精确重排：低维字段召回 top_k × COARSE_OVERFETCH 条候选，再用完整向量重新打分 ====
+def search_coarse_ids(query_vectors: List[List[float]], top_k: int, filter_expr: str,
+                      partition_names: Optional[List[str]], min_score: Optional[float]) -> List[List[Dict]]:
+    # 粗排分数只用于挑候选；min_score 作用于重排后的完整向量余弦相似度
+    candidates = to_hits(get_client().search(
+        collection_name=COLLECTION_NAME,
+        data=load_projection(describe_fields()[COARSE_FIELD]["params"]["dim"]).project(query_vectors).tolist(),
+        anns_field=COARSE_FIELD,
+        search_params=SEARCH_PARAMS,
+        limit=top_k * COARSE_OVERFETCH,
+        filter=filter_expr,
+        partition_names=partition_names,
+        output_fields=["pmid"],
+        consistency_level="Bounded"
+    ))
+    rows = fetch_fields([hit["pmid"] for hits in candidates for hit in hits], [VECTOR_FIELD], partition_names)
+    results = []
+    for query_vector, hits in zip(query_vectors, candidates):
+        hits = [hit for hit in hits if VECTOR_FIELD in rows.get(hit["pmid"], {})]
+        if not hits:
+            results.append([])
+            continue
+        scores = rescore(query_vector, np.stack([rows[hit["pmid"]][VECTOR_FIELD] for hit in hits]))
+        results.append([{"pmid": hits[i]["pmid"], "score": float(scores[i])} for i in np.argsort(-scores)[:top_k]
+                        if min_score is None or scores[i] >= min_score])
+    return results
+
+
+# ==== 集合字段信息：是否有 BM25 稀疏字段、向量的存储类型 ====
+# Milvus Lite（本地 .db 文件）没有 hybrid_search，启动时即确定走逐路检索 + 本地融合
+_collection_state = {"generation": None, "fields": None,
+                     "hybrid_supported": not (MILVUS_URI or "").endswith(".db")}
+
+
+def hybrid_unsupported(error: Exception) -> bool:
+    # 只有服务端不支持 hybrid_search 才降级；超时、过滤表达式错误等照常抛出
+    cause = error.__cause__ if isinstance(error.__cause__, grpc.RpcError) else error
+    if isinstance(cause, grpc.RpcError):
+        return cause.code() == grpc.StatusCode.UNIMPLEMENTED
+    message = str(getattr(error, "message", error)).lower()
+    return "function_score" in message or "not support" in message or "unimplemented" in message
+
+
+def describe_fields() -> Dict[str, Dict]:
+    # 迁移脚本切换集合后会更新 generation，随之重新读取 schema
+    generation = read_collection_generation(COLLECTION_NAME)
+    if _collection_state["generation"] != generation:
+        fields = {f["name"]: f for f in get_client().describe_collection(COLLECTION_NAME)["fields"]}
+        _collection_state.update(generation=generation, fields=fields)
+    return _collection_state["fields"]
+
+
+def collection_sparse_fields() -> List[str]:
+    return sparse_fields_in(describe_fields())
+
+
+def is_lean_collection() -> bool:
+    # 精简 schema：abstract / authors 存在本地文档库中；快照检索两种过滤写法都支持，Milvus 不可用时按完整 schema 处理
+    if not milvus_available():
+        return False
+    try:
+        return bool(lean_fields(describe_fields()))
+    except Exception as e:
+        fail_over(e)
+        return False
+
+
+def collection_vector_dtype() -> str:
+    return dtype_of(describe_fields()[VECTOR_FIELD]["type"])
+
+
+# ==== BM25 稀疏检索 / 混合检索 ====
+
+def search_hybrid_ids(query_vectors: List[List[float]], query_texts: List[str], top_k: int, filter_expr: str,
+                      partition_names: Optional[List[str]], dense_params: Dict, mode: str,
+                      fusion: str) -> List[List[Dict]]:
+    available = collection_sparse_fields()
+    if not available:
+        raise ValueError("集合没有 BM25 稀疏字段，请先运行 migrate_schema.py")
+    if len(query_texts) != len(query_vectors):
+        raise ValueError("sparse / hybrid 模式需要与查询向量一一对应的查询文本")
+
+    leg_limit = top_k * HYBRID_OVERFETCH
+    legs, weights = [], []
+    if mode == "hybrid":
+        legs.append(AnnSearchRequest(data=encode_queries(query_vectors, collection_vector_dtype()),
+                                     anns_field=VECTOR_FIELD, param=dense_params,
+                                     limit=leg_limit, expr=filter_expr or None))
+        weights.append(HYBRID_WEIGHTS[0])
+    for i, sparse_field in enumerate(SPARSE_FIELDS.values(), 1):
+        if sparse_field not in available:
+            continue  # 精简 schema 没有 abstract 的 BM25
+        legs.append(AnnSearchRequest(data=query_texts, anns_field=sparse_field, param={"metric_type": "BM25"},
+                                     limit=leg_limit, expr=filter_expr or None))
+        weights.append(HYBRID_WEIGHTS[i])
+
+    # 一次 hybrid_search 请求内完成多路召回与融合
+    if _collection_state["hybrid_supported"]:
+        ranker = RRFRanker(HYBRID_RRF_K) if fusion == "rrf" else WeightedRanker(*weights)
+        try:
+            return to_hits(get_client().hybrid_search(
+                collection_name=COLLECTION_NAME,
+                reqs=legs,
+                ranker=ranker,
+                limit=top_k,
+                partition_names=partition_names,
+                output_fields=["pmid"],
+                consistency_level="Bounded"
+            ))
+        except MilvusException as e:
+            if not hybrid_unsupported(e):
+                raise
+            # 服务端不支持 hybrid_search（如 Milvus Lite）：之后改为逐路检索、本地融合
+            print(f"⚠️ hybrid_search 不可用，改为本地融合: {e}")
+            _collection_state["hybrid_supported"] = False
+
+    per_leg = [to_hits(get_client().search(
+        collection_name=COLLECTION_NAME,
+        data=leg.data,
+        anns_field=leg.anns_field,
+        search_params=leg.param,
+        limit=leg.limit,
+        filter=filter_expr,
+        partition_names=partition_names,
+        output_fields=["pmid"],
+        consistency_level="Bounded"
+    )) for leg in legs]
+    fused = []
+    for qi in range(len(query_vectors)):
+        lists = [hits[qi] for hits in per_leg]
+        fused.append(rrf_fuse(lists, HYBRID_RRF_K, top_k) if fusion == "rrf" else weighted_fuse(lists, weights, top_k))
+    return fused
+
+
+# ==== 第二阶段：按主键批量 query，只取调用方需要的字段 ====
+def fetch_fields(pmids: List[str], fields: List[str], partition_names: Optional[List[str]] = None) -> Dict[str, Dict]:
+    if not pmids or not fields:
+        return {}
+    # 精简 schema 的集合里没有的字段（abstract / authors）从本地文档库批量读取
+    in_milvus = [f for f in fields if f in describe_fields()]
+    rows: Dict[str, Dict] = {}
+    if in_milvus:
+        rows = {row["pmid"]: row for row in get_client().query(
             collection_name=COLLECTION_NAME,
-            data=[query_vector],
-            search_params={
-                "metric_type": "COSINE",
-                "params": {"nprobe": 1}
-            },
-            limit=top_k,
-            output_fields=["pmid", "title", "abstract", "doi", "authors", "journal", "year", "source"],
+            filter=f"pmid in {json.dumps(list(dict.fromkeys(pmids)))}",
+            output_fields=["pmid"] + in_milvus,
+            partition_names=partition_names,
             consistency_level="Bounded"
-        )
-        results = []
-        for hit in search_result[0]:  # 第一条 query 的结果
-            entity = hit["entity"]
-            results.append({
-                "pmid": entity.get("pmid"),
-                "title": entity.get("title"),
-                "abstract": entity.get("abstract"),
-                "doi": entity.get("doi"),
-                "authors": entity.get("authors"),
-                "journal": entity.get("journal"),
-                "year": entity.get("year"),
-                "source": entity.get("source"),
-                "score": hit.get("distance")
-            })
-
-        print(f"✅ 检索完成，找到 {len(results)} 篇相关文献。")
+        )}
+        if VECTOR_FIELD in in_milvus:
+            # 半精度集合 query 返回 [bytes]，统一解码为 float32
+            vector_dtype = collection_vector_dtype()
+            for row in rows.values():
+                row[VECTOR_FIELD] = decode_vector(row[VECTOR_FIELD], vector_dtype)
+    return hydrate_rows(rows, pmids, [f for f in fields if f not in in_milvus])
+
+
+def hydrate(hits: List[Dict], rows: Dict[str, Dict], fields: List[str]) -> List[Dict]:
+    results = []
+    for hit in hits:
+        row = rows.get(hit["pmid"], {})
+        results.append({"pmid": hit["pmid"], **{f: row.get(f) for f in fields}, "score": hit["score"]})
+    return results
+
+def resolve_fields(output_fields: Optional[List[str]]) -> List[str]:
+    return [f for f in (output_fields if output_fields is not None else OUTPUT_FIELDS) if f != "pmid"]
+
+
+# ==== 结果多样化：多取候选 → 合并近重复 → MMR 选出 top_k ====
+def candidate_limit(top_k: int, diversity: float) -> int:
+    return top_k * DIVERSITY_OVERFETCH if diversity > 0 else top_k
+
+
+def fetch_fields_for(fields: List[str], diversity: float) -> List[str]:
+    # 多样化需要候选的 title / doi / 向量，随第二阶段的主键 query 一起取回
+    if diversity <= 0:
+        return fields
+    return fields + [f for f in ("title", "doi", VECTOR_FIELD) if f not in fields]
+
+
+def diversify(hits: List[Dict], rows: Dict[str, Dict], query_vector: List[float], top_k: int,
+              diversity: float) -> List[Dict]:
+    # diversity 为 0~1：0 不处理，越大越偏向与已选文献不同的结果（MMR 的 lambda = 1 - diversity）
+    if diversity <= 0:
+        return hits
+    hits = [hit for hit in collapse_duplicates(hits, rows) if VECTOR_FIELD in rows.get(hit["pmid"], {})]
+    if len(hits) <= top_k:
+        return hits
+    vectors = np.stack([rows[hit["pmid"]][VECTOR_FIELD] for hit in hits])
+    return [hits[i] for i in mmr_select(query_vector, vectors, top_k, 1 - diversity)]
+
+
+def result_cache_key(query_vector: List[float], top_k: int, filter_expr: str, partition_names: Optional[List[str]],
+                     min_score: Optional[float], fields: List[str], mode: str, fusion: str, diversity: float):
+    return search_result_cache.make_key(query_vector, top_k=top_k, filter_expr=filter_expr,
+                                        partitions=",".join(partition_names or []), min_score=min_score,
+                                        fields=",".join(fields), mode=mode, fusion=fusion if mode != "dense" else "",
+                                        diversity=diversity)
+
+# ==== 检索：Milvus 优先，出错时切换到精确检索快照 ====
+def retrieve(query_vectors: List[List[float]], query_texts: List[str], top_k: int, filter_expr: str,
+             partition_names: Optional[List[str]], min_score: Optional[float], fields: List[str], mode: str,
+             fusion: str, diversity: float):
+    # 返回 (每条查询的结果列表, 实际使用的后端 "milvus" / "exact")
+    if milvus_available():
+        try:
+            hits_per_query = search_ids(query_vectors, candidate_limit(top_k, diversity), filter_expr,
+                                        partition_names, min_score, mode=mode, query_texts=query_texts, fusion=fusion)
+            rows = fetch_fields([hit["pmid"] for hits in hits_per_query for hit in hits],
+                                fetch_fields_for(fields, diversity), partition_names)
+            return finish(hits_per_query, rows, query_vectors, top_k, fields, diversity), "milvus"
+        except Exception as e:
+            fail_over(e)
+
+    index = get_exact_index()
+    if index is None:
+        raise RuntimeError("Milvus 不可用且没有精确检索快照，请先运行 python exact_search.py 导出")
+    if mode != "dense":
+        print(f"⚠️ 精确检索快照只支持向量检索，{mode} 模式按 dense 处理")
+    hits_per_query = index.search(query_vectors, candidate_limit(top_k, diversity), filter_expr, min_score)
+    rows = index.fetch([hit["pmid"] for hits in hits_per_query for hit in hits], fetch_fields_for(fields, diversity))
+    return finish(hits_per_query, rows, query_vectors, top_k, fields, diversity), "exact"
+
+
+def finish(hits_per_query: List[List[Dict]], rows: Dict[str, Dict], query_vectors: List[List[float]], top_k: int,
+           fields: List[str], diversity: float) -> List[List[Dict]]:
+    return [hydrate(diversify(hits, rows, query_vector, top_k, diversity), rows, fields)
+            for hits, query_vector in zip(hits_per_query, query_vectors)]
+
+
+def search_in_milvus(query_vector: List[float], top_k: int = 5, filter_expr: str = "",
+                     partition_names: Optional[List[str]] = None, min_score: Optional[float] = None,
+                     output_fields: Optional[List[str]] = None, mode: str = "dense", query_text: str = "",
+                     fusion: str = HYBRID_FUSION, diversity: float = 0.0) -> List[Dict]:
+    # output_fields 为需要返回的字段（pmid 与 score 总会返回），默认返回全部字段
+    fields = resolve_fields(output_fields)
+    if partition_names is not None and not partition_names:
+        return []  # 年份范围内没有任何已加载的分区
+    cache_key = result_cache_key(query_vector, top_k, filter_expr, partition_names, min_score, fields, mode, fusion,
+                                 diversity)
+    cached = search_result_cache.get(cache_key)
+    if cached is not None:
+        print(f"⚡ 命中检索结果缓存，共 {len(cached)} 篇")
+        return cached
+
+    try:
+        print(f"🔍 正在搜索 Top-{top_k} 向量...")
+        grouped, backend = retrieve([query_vector], [query_text], top_k, filter_expr, partition_names, min_score,
+                                    fields, mode, fusion, diversity)
+        results = grouped[0]
+
+        print(f"✅ 检索完成（{backend}），找到 {len(results)} 篇相关文献。")
+        if backend == "milvus":
+            search_result_cache.put(cache_key, results)  # 快照结果可能与集合不一致，不写缓存
         return results
 
     except Exception as e:
         raise RuntimeError(f"[ERROR] Milvus 向量检索失败: {e}")
 
+# ==== 批量检索：多条查询向量一次 search，命中的 pmid 合并成一次 query ====
+def search_in_milvus_batch(query_vectors: List[List[float]], top_k: int = 5, filter_expr: str = "",
+                           partition_names: Optional[List[str]] = None, min_score: Optional[float] = None,
+                           output_fields: Optional[List[str]] = None, mode: str = "dense",
+                           query_texts: Optional[List[str]] = None, fusion: str = HYBRID_FUSION,
+                           diversity: float = 0.0) -> List[List[Dict]]:
+    fields = resolve_fields(output_fields)
+    query_texts = query_texts or [""] * len(query_vectors)
+    if partition_names is not None and not partition_names:
+        return [[] for _ in query_vectors]
+    keys = [result_cache_key(v, top_k, filter_expr, partition_names, min_score, fields, mode, fusion, diversity)
+            for v in query_vectors]
+    grouped: List[Optional[List[Dict]]] = [search_result_cache.get(key) for key in keys]
+    todo = [i for i, cached in enumerate(grouped) if cached is None]
+    if not todo:
+        print(f"⚡ {len(keys)} 条查询全部命中检索结果缓存")
+        return grouped
+
+    try:
+        print(f"🔍 正在批量搜索 {len(todo)} 条查询（Top-{top_k}）...")
+        results, backend = retrieve([query_vectors[i] for i in todo], [query_texts[i] for i in todo], top_k,
+                                    filter_expr, partition_names, min_score, fields, mode, fusion, diversity)
+        for i, result in zip(todo, results):
+            grouped[i] = result
+            if backend == "milvus":
+                search_result_cache.put(keys[i], result)
+        print(f"✅ 批量检索完成（{backend}），共 {sum(len(g) for g in grouped)} 条结果。")
+        return grouped
+
+    except Exception as e:
+        raise RuntimeError(f"[ERROR] Milvus 批量向量检索失败: {e}")
+
 # ==== 高层封装：从文本到搜索结果 ====
-def search_pubmed_by_query(query: str, top_k: int = 5) -> List[Dict]:
+def search_pubmed_by_query(query: str, top_k: int = 5, **search_options) -> List[Dict]:
+    # search_options 透传给 search_in_milvus：filter_expr / partition_names / min_score / output_fields / mode / fusion /
+    # diversity
+    print(f"\n🎯 开始检索: \"{query}\"")
+    query_vector = get_query_embedding(query)
+    return search_in_milvus(query_vector, top_k=top_k, query_text=query, **search_options)
+
+# ==== 异步版本：embedding 走共享 httpx.AsyncClient，Milvus 检索放到线程池，不阻塞事件循环 ====
+_async_embedding_client: Optional[AsyncEmbeddingClient] = None
+
+
+def get_async_embedding_client() -> AsyncEmbeddingClient:
+    global _async_embedding_client
+    if _async_embedding_client is None:
+        _async_embedding_client = AsyncEmbeddingClient()
+    return _async_embedding_client
+
+
+async def get_query_embedding_async(query: str) -> List[float]:
+    vector = query_embedding_cache.get(query, EMBEDDING_MODEL or "")
+    if vector is None:
+        vector = await get_async_embedding_client().embed_one(query)
+        query_embedding_cache.put(query, EMBEDDING_MODEL or "", vector)
+    return vector
+
+
+async def get_query_embeddings_async(queries: List[str]) -> List[List[float]]:
+    # 缓存未命中的查询合并成一次 embedding 请求
+    vectors = [query_embedding_cache.get(q, EMBEDDING_MODEL or "") for q in queries]
+    missing = [i for i, v in enumerate(vectors) if v is None]
+    if missing:
+        embeddings = await get_async_embedding_client().embed([queries[i] for i in missing])
+        for i, vector in zip(missing, embeddings):
+            query_embedding_cache.put(queries[i], EMBEDDING_MODEL or "", vector)
+            vectors[i] = vector
+    return vectors
+
+
+async def search_pubmed_by_query_async(query: str, top_k: int = 5, **search_options) -> List[Dict]:
     print(f"\n🎯 开始检索: \"{query}\"")
-    query_vector = get_embedding(query)
-    return search_in_milvus(query_vector, top_k=top_k)
+    query_vector = await get_query_embedding_async(query)
+    return await asyncio.to_thread(search_in_milvus, query_vector, top_k, query_text=query, **search_options)
+
+async def search_pubmed_by_queries_async(queries: List[str], top_k: int = 5, **search_options) -> List[List[Dict]]:
+    print(f"\n🎯 开始批量检索 {len(queries)} 条查询")
+    query_vectors = await get_query_embeddings_async(queries)
+    return await asyncio.to_thread(search_in_milvus_batch, query_vectors, top_k, query_texts=queries, **search_options)
 
 # ==== 示例运行 ====
 if __name__ == "__main__":
@@ -82,4 +505,4 @@ if __name__ == "__main__":
         print(f"DOI: {item['doi']}")
         print(f"Authors: {', '.join(item['authors']) if isinstance(item['authors'], list) else item['authors']}")
         print(f"Journal: {item['journal']} ({item['year']})")
-        print(f"Abstract: {item['abstract'][:300]}...")
\ No newline at end of file
+        print(f"Abstract: {item['abstract'][:300]}...")
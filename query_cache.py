@@ -0,0 +1,195 @@
+import os
+import re
+import hashlib
+import time
+import sqlite3
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+from dotenv import find_dotenv, load_dotenv
+
+# ==== 配置 ====
+load_dotenv(find_dotenv(usecwd=True))
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "10000"))   # 0 表示关闭缓存
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "86400"))   # 秒
+QUERY_CACHE_PATH = os.getenv("QUERY_CACHE_PATH", "")             # 为空时只缓存在内存
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "2000"))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "3600"))
+# 检索使用 Bounded 一致性，入库后的几秒内可能还看不到新数据：generation 更新后这段时间内不写结果缓存
+RESULT_CACHE_GRACE = float(os.getenv("RESULT_CACHE_GRACE", "10"))  # 秒
+# 入库脚本与 MCP Server 共用的 generation 目录（跨机器部署时指向共享盘）
+GENERATION_DIR = os.getenv(
+    "CACHE_GENERATION_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".generation")
+)
+
+
+# ==== 查询文本归一化：大小写、全半角、多余空白和首尾标点不影响命中 ====
+def normalize_query(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = re.sub(r"\s+", " ", text)
+    return text.strip(" \t\n.,;:!?。，；：！？")
+
+
+# ==== 带容量上限（LRU）和过期时间（TTL）的线程安全缓存 ====
+class LRUTTLCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and (self.ttl <= 0 or time.time() - item[0] < self.ttl):
+                self._data.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            if item is not None:
+                del self._data[key]  # 已过期
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, value: Any, created: Optional[float] = None):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (created if created is not None else time.time(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+# ==== 查询向量缓存：key = (模型名, 归一化查询)，可选 SQLite 落盘，重启后自动预热 ====
+class QueryEmbeddingCache:
+    def __init__(self, maxsize: int = QUERY_CACHE_SIZE, ttl: float = QUERY_CACHE_TTL, path: str = QUERY_CACHE_PATH):
+        self.cache = LRUTTLCache(maxsize, ttl)
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        if path and maxsize > 0:
+            self._open(path)
+
+    def _open(self, path: str):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS query_embedding ("
+            "model TEXT, query TEXT, vector BLOB, created REAL, PRIMARY KEY (model, query))"
+        )
+        if self.cache.ttl > 0:
+            self._db.execute("DELETE FROM query_embedding WHERE created < ?", (time.time() - self.cache.ttl,))
+        self._db.commit()
+        # 只加载最近的 maxsize 条，按时间从旧到新放入，保持 LRU 顺序
+        rows = self._db.execute(
+            "SELECT model, query, vector, created FROM query_embedding ORDER BY created DESC LIMIT ?",
+            (self.cache.maxsize,)
+        ).fetchall()
+        for model, query, blob, created in reversed(rows):
+            self.cache.put((model, query), array("f", blob).tolist(), created=created)
+        print(f"♻️ 查询向量缓存已预热: {len(rows)} 条 ({path})")
+
+    def get(self, query: str, model: str) -> Optional[List[float]]:
+        return self.cache.get((model, normalize_query(query)))
+
+    def put(self, query: str, model: str, vector: List[float]):
+        key = (model, normalize_query(query))
+        self.cache.put(key, vector)
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO query_embedding VALUES (?, ?, ?, ?)",
+                    (key[0], key[1], array("f", vector).tobytes(), time.time())
+                )
+                self._db.commit()
+
+    def get_or_compute(self, query: str, model: str, compute: Callable[[str], List[float]]) -> List[float]:
+        vector = self.get(query, model)
+        if vector is None:
+            vector = compute(query)
+            self.put(query, model, vector)
+        return vector
+
+    def stats(self) -> Dict[str, Any]:
+        return self.cache.stats()
+
+
+# ==== collection generation：每次写入新数据后更新，检索结果缓存据此失效 ====
+def generation_path(collection: str) -> str:
+    return os.path.join(GENERATION_DIR, f"{collection}.generation")
+
+
+def bump_collection_generation(collection: str):
+    os.makedirs(GENERATION_DIR, exist_ok=True)
+    path = generation_path(collection)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(str(time.time_ns()))
+    os.replace(tmp_path, path)  # 原子替换，读方不会读到半个文件
+
+
+def read_collection_generation(collection: str) -> str:
+    try:
+        with open(generation_path(collection), "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return ""
+
+
+def generation_age(generation: str) -> float:
+    # generation 为入库时的 time.time_ns()；没有入库记录时视为足够久
+    if not generation.isdigit():
+        return float("inf")
+    return time.time() - int(generation) / 1e9
+
+
+# ==== 检索结果缓存：key = (generation, 查询向量摘要, 检索参数) ====
+class SearchResultCache:
+    def __init__(self, collection: str, maxsize: int = RESULT_CACHE_SIZE, ttl: float = RESULT_CACHE_TTL):
+        self.collection = collection
+        self.cache = LRUTTLCache(maxsize, ttl)
+        self._generation: Optional[str] = None
+
+    def make_key(self, vector: List[float], **params) -> Tuple:
+        generation = read_collection_generation(self.collection)
+        if generation != self._generation:
+            if self._generation is not None:
+                print("♻️ 检测到新数据入库，清空检索结果缓存")
+            self.cache.clear()
+            self._generation = generation
+        digest = hashlib.blake2b(array("f", vector).tobytes(), digest_size=16).hexdigest()
+        return (generation, digest) + tuple(sorted((k, repr(v)) for k, v in params.items()))
+
+    def get(self, key: Tuple) -> Optional[List[Dict]]:
+        results = self.cache.get(key)
+        return [dict(r) for r in results] if results is not None else None
+
+    def put(self, key: Tuple, results: List[Dict]):
+        # 检索期间有新数据入库，或刚入库不久（Bounded 一致性可能还看不到新文献）时，不写入缓存
+        generation = read_collection_generation(self.collection)
+        if key[0] != generation or generation_age(generation) < RESULT_CACHE_GRACE:
+            return
+        self.cache.put(key, [dict(r) for r in results])
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.cache.stats(), "generation": self._generation}
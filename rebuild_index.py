@@ -0,0 +1,46 @@
+import os
+import argparse
+from pymilvus import connections, Collection
+from dotenv import load_dotenv
+from coarse_vectors import COARSE_FIELD
+from collection_schema import coarse_dim_of
+from index_profiles import (
+    INDEX_PROFILE, INDEX_PROFILES, VECTOR_FIELD, build_vector_index, drop_vector_index, get_index_params
+)
+from query_cache import bump_collection_generation
+
+# ==== 配置 ====
+load_dotenv()
+COLLECTION_NAME = os.getenv("COLLECTION_NAME", "pubmed_rare_disease_db")
+
+
+def index_field(collection: Collection) -> str:
+    # 有粗排字段时 ANN 检索走粗排字段，档位作用于它；完整向量保持 FLAT（只用于重排）
+    return COARSE_FIELD if coarse_dim_of(collection) else VECTOR_FIELD
+
+
+# ==== 索引迁移：在已有集合上换索引档位，数据不动，无需重新入库 ====
+def migrate_index(collection: Collection, profile: str):
+    index_params = get_index_params(profile)
+    field = index_field(collection)
+    current = next((dict(i.params) for i in collection.indexes if i.field_name == field), None)
+    if current is not None and current.get("index_type") == index_params["index_type"] \
+            and current.get("params", {}) == index_params["params"]:
+        print(f"✅ 当前索引已是 {profile}，无需迁移")
+        return
+
+    print(f"🔁 迁移向量索引 → {profile}（{collection.num_entities} 条，重建期间集合不可检索）")
+    drop_vector_index(collection, field)
+    build_vector_index(collection, index_params, field)
+    bump_collection_generation(collection.name)  # 使 MCP Server 的检索结果缓存失效
+    print(f"💡 请在 .env 中设置 INDEX_PROFILE={profile} 并重启检索服务，使检索参数与新索引一致")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="重建向量索引（切换索引档位，不重新入库）")
+    parser.add_argument("--profile", choices=sorted(INDEX_PROFILES), default=INDEX_PROFILE, help="目标索引档位")
+    parser.add_argument("--collection", default=COLLECTION_NAME)
+    args = parser.parse_args()
+
+    connections.connect("default", host="localhost", port="19530")
+    migrate_index(Collection(args.collection), args.profile)
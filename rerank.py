@@ -0,0 +1,79 @@
+import re
+from typing import Dict, List, Sequence
+import numpy as np
+
+# ==== 多路召回结果融合（hybrid_search 不可用时在本地完成） ====
+# rrf_fuse 与 Milvus 的 RRFRanker 公式相同；weighted_fuse 先在本地做 min-max 归一化，
+# Milvus 的 WeightedRanker 不做这一步，两者的融合分数不可直接比较
+# 每一路结果为按相关度降序排列的 [{"pmid", "score"}, ...]
+
+
+def rrf_fuse(ranked_lists: Sequence[List[Dict]], k: int = 60, limit: int = 10) -> List[Dict]:
+    # Reciprocal Rank Fusion：只看名次，不受各路分数尺度影响
+    scores: Dict[str, float] = {}
+    for hits in ranked_lists:
+        for rank, hit in enumerate(hits):
+            scores[hit["pmid"]] = scores.get(hit["pmid"], 0.0) + 1.0 / (k + rank + 1)
+    ranked = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:limit]
+    return [{"pmid": pmid, "score": score} for pmid, score in ranked]
+
+
+def weighted_fuse(ranked_lists: Sequence[List[Dict]], weights: Sequence[float], limit: int = 10) -> List[Dict]:
+    # 各路分数先按本路最好 / 最差归一化到 [0, 1]（与分数方向无关），再加权求和
+    scores: Dict[str, float] = {}
+    for hits, weight in zip(ranked_lists, weights):
+        if not hits:
+            continue
+        best, worst = hits[0]["score"], hits[-1]["score"]
+        span = best - worst
+        for hit in hits:
+            norm = (hit["score"] - worst) / span if span else 1.0
+            scores[hit["pmid"]] = scores.get(hit["pmid"], 0.0) + weight * norm
+    ranked = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:limit]
+    return [{"pmid": pmid, "score": score} for pmid, score in ranked]
+
+
+# ==== 近重复合并：勘误、会议 / 期刊重复发表等标题或 DOI 相同的文献只保留得分最高的一篇 ====
+_NOTICE_PREFIX = re.compile(r"^(erratum|corrigendum|correction|retraction)( to| for| of)?\b[:\s-]*")
+
+
+def normalize_title(title: str) -> str:
+    title = re.sub(r"[^a-z0-9]+", " ", (title or "").lower()).strip()
+    return _NOTICE_PREFIX.sub("", title).strip()
+
+
+def collapse_duplicates(hits: List[Dict], rows: Dict[str, Dict]) -> List[Dict]:
+    # hits 按得分降序；rows 为按 pmid 拉取的 title / doi
+    seen, kept = set(), []
+    for hit in hits:
+        row = rows.get(hit["pmid"], {})
+        keys = {("title", normalize_title(row.get("title", ""))), ("doi", (row.get("doi") or "").strip().lower())}
+        keys = {key for key in keys if key[1]}
+        if keys & seen:
+            continue
+        seen |= keys
+        kept.append(hit)
+    return kept
+
+
+# ==== MMR（maximal marginal relevance）：在相关度与已选文献的相似度之间权衡 ====
+def mmr_select(query_vector: Sequence[float], candidate_vectors: np.ndarray, k: int, lambda_: float) -> List[int]:
+    # 返回被选中候选的下标；lambda_=1 退化为按相关度排序，越小越偏向多样性
+    vectors = np.asarray(candidate_vectors, dtype=np.float32)
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    query = np.asarray(query_vector, dtype=np.float32)
+    query = query / max(np.linalg.norm(query), 1e-12)
+    relevance = vectors @ query
+    similarity = vectors @ vectors.T  # 候选数很少（top_k × 倍数），一次算出两两相似度
+
+    selected: List[int] = []
+    max_similarity = np.zeros(len(vectors), dtype=np.float32)
+    available = np.ones(len(vectors), dtype=bool)
+    for _ in range(min(k, len(vectors))):
+        scores = lambda_ * relevance - (1 - lambda_) * max_similarity
+        scores[~available] = -np.inf
+        pick = int(np.argmax(scores))
+        selected.append(pick)
+        available[pick] = False
+        max_similarity = np.maximum(max_similarity, similarity[pick])
+    return selected
@@ -1,46 +1,34 @@
 import os
 from pymilvus import MilvusClient
 from typing import List, Dict
-import requests
 from dotenv import load_dotenv
+from collection_schema import OUTPUT_FIELDS
+from doc_store import hydrate_rows, lean_fields
+from embedding_client import get_embedding
+from index_profiles import VECTOR_FIELD, get_search_params
+from vector_codec import client_vector_dtype, encode_queries
 
 # ==== 配置 ====
 load_dotenv()
 MILVUS_URI = os.getenv("MILVUS_URI")
 COLLECTION_NAME = os.getenv("COLLECTION_NAME")
-EMBEDDING_DIM = 1024
-EMBEDDING_API_URL = os.getenv("EMBEDDING_API_URL")
-EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL")
+SEARCH_PARAMS = get_search_params()  # 由 INDEX_PROFILE 决定 nprobe / ef 等参数
 
 # ==== 初始化客户端 ====
 client = MilvusClient(uri=MILVUS_URI)
 
-# ==== 生成 embedding ====
-def get_embedding(text: str) -> List[float]:
-    payload = {
-        "input": [text],
-        "model": EMBEDDING_MODEL
-    }
-    response = requests.post(EMBEDDING_API_URL, json=payload)
-    response.raise_for_status()
-    embedding = response.json()["data"][0]["embedding"]
-    if len(embedding) != EMBEDDING_DIM:
-        raise ValueError(f"Embedding dim mismatch: {len(embedding)} != {EMBEDDING_DIM}")
-    return embedding
-
 # ==== Milvus 向量检索 ====
 def search_in_milvus(query_vector: List[float], top_k: int = 5) -> List[Dict]:
     try:
         print(f"🔍 正在 Milvus 中搜索 Top-{top_k} 向量...")
+        names = [f["name"] for f in client.describe_collection(COLLECTION_NAME)["fields"]]
         search_result = client.search(
             collection_name=COLLECTION_NAME,
-            data=[query_vector],
-            search_params={
-                "metric_type": "COSINE",
-                "params": {"nprobe": 1}
-            },
+            data=encode_queries([query_vector], client_vector_dtype(client, COLLECTION_NAME)),  # float16 / bfloat16 集合需要同类型的查询向量
+            anns_field=VECTOR_FIELD,
+            search_params=SEARCH_PARAMS,
             limit=top_k,
-            output_fields=["pmid", "title", "abstract", "doi", "authors", "journal", "year", "source"],
+            output_fields=[f for f in OUTPUT_FIELDS if f in names],  # 精简 schema 的集合没有 abstract / authors
             consistency_level="Bounded"
         )
         results = []
@@ -58,6 +46,11 @@ def search_in_milvus(query_vector: List[float], top_k: int = 5) -> List[Dict]:
                 "score": hit.get("distance")
             })
 
+        # 精简 schema：abstract / authors 从本地文档库补齐
+        docs = hydrate_rows({}, [r["pmid"] for r in results], lean_fields(names))
+        for r in results:
+            r.update(docs.get(r["pmid"], {}))
+
         print(f"✅ 检索完成，找到 {len(results)} 篇相关文献。")
         return results
 
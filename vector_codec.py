@@ -0,0 +1,94 @@
+import os
+from typing import Dict, List, Sequence
+import numpy as np
+from pymilvus import DataType
+from dotenv import find_dotenv, load_dotenv
+from index_profiles import VECTOR_FIELD
+
+try:
+    import ml_dtypes  # 只有 BFLOAT16_VECTOR 的查询向量需要 numpy 的 bfloat16 类型
+except ImportError:
+    ml_dtypes = None
+
+# ==== 配置 ====
+load_dotenv(find_dotenv(usecwd=True))
+# float32 每篇 4KB（1024 维）；float16 / bfloat16 减半。新建集合与迁移时使用该类型
+VECTOR_DTYPE = os.getenv("VECTOR_DTYPE", "float32")
+
+# ==== 向量存储类型 ====
+# float16   精度较高，数值范围小（归一化后的 embedding 足够）
+# bfloat16  范围与 float32 相同，尾数更短；查询时需要 pip install ml_dtypes
+VECTOR_DATA_TYPES: Dict[str, DataType] = {
+    "float32": DataType.FLOAT_VECTOR,
+    "float16": DataType.FLOAT16_VECTOR,
+    "bfloat16": DataType.BFLOAT16_VECTOR,
+}
+
+
+def get_data_type(name: str) -> DataType:
+    if name not in VECTOR_DATA_TYPES:
+        raise ValueError(f"Unknown vector dtype: {name} (available: {', '.join(VECTOR_DATA_TYPES)})")
+    return VECTOR_DATA_TYPES[name]
+
+
+def dtype_of(data_type) -> str:
+    # data_type 可以是 DataType，也可以是 describe_collection 返回的枚举值
+    for name, candidate in VECTOR_DATA_TYPES.items():
+        if data_type == candidate or data_type == candidate.value:
+            return name
+    raise ValueError(f"Not a dense vector type: {data_type}")
+
+
+def sidecar_dtype(name: str = VECTOR_DTYPE) -> np.dtype:
+    # 中间 .npy 文件：半精度集合的向量以 float16 落盘，体积减半
+    return np.dtype(np.float32) if name == "float32" else np.dtype(np.float16)
+
+
+def client_vector_dtype(client, collection_name: str) -> str:
+    # MilvusClient 版本；ORM 的 Collection 见 collection_schema.vector_dtype_of
+    fields = client.describe_collection(collection_name)["fields"]
+    return dtype_of(next(f["type"] for f in fields if f["name"] == VECTOR_FIELD))
+
+
+# ==== bfloat16 与 float32 互转（高 16 位，就近舍入） ====
+def to_bfloat16_bits(vectors: np.ndarray) -> np.ndarray:
+    bits = np.ascontiguousarray(vectors, dtype=np.float32).view(np.uint32)
+    return ((bits + 0x7FFF + ((bits >> 16) & 1)) >> 16).astype(np.uint16)
+
+
+def from_bfloat16_bits(bits: np.ndarray) -> np.ndarray:
+    return (bits.astype(np.uint32) << 16).view(np.float32)
+
+
+# ==== 写入：按列 insert 时半精度向量每行为 2 × dim 字节 ====
+def encode_vectors(vectors: Sequence, name: str):
+    if name == "float32":
+        # float16 的中间文件写入 float32 集合时先转换
+        if isinstance(vectors, np.ndarray) and vectors.dtype != np.float32:
+            return vectors.astype(np.float32)
+        return vectors
+    matrix = np.asarray(vectors, dtype=np.float32)
+    packed = to_bfloat16_bits(matrix) if name == "bfloat16" else matrix.astype(np.float16)
+    return [row.tobytes() for row in packed]
+
+
+# ==== 检索：查询向量需与字段类型一致 ====
+def encode_queries(vectors: Sequence[Sequence[float]], name: str) -> List:
+    if name == "float32":
+        return list(vectors)
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if name == "float16":
+        return list(matrix.astype(np.float16))
+    if ml_dtypes is None:
+        raise ImportError("检索 BFLOAT16_VECTOR 集合需要 ml_dtypes：pip install ml_dtypes")
+    return list(matrix.astype(ml_dtypes.bfloat16))
+
+
+# ==== 读取：query 返回的半精度向量为 [bytes]，统一解码为 float32 ====
+def decode_vector(value, name: str) -> np.ndarray:
+    if isinstance(value, (list, tuple)) and len(value) == 1 and isinstance(value[0], bytes):
+        value = value[0]
+    if isinstance(value, bytes):
+        bits = np.frombuffer(value, dtype=np.uint16)
+        return from_bfloat16_bits(bits) if name == "bfloat16" else bits.view(np.float16).astype(np.float32)
+    return np.asarray(value, dtype=np.float32)
@@ -0,0 +1,60 @@
+import os
+import json
+from typing import Dict, Iterator, List, Sequence, Tuple
+import numpy as np
+
+# ==== 紧凑的中间格式：元数据 JSONL + 按行对齐的 float32 / float16 .npy 向量块 ====
+# batch_0.jsonl  每行一条记录（不含 embedding）
+# batch_0.npy    shape = (行数, dim)，第 i 行对应 jsonl 第 i 行
+META_SUFFIX = ".jsonl"
+VECTOR_SUFFIX = ".npy"
+
+
+def sidecar_paths(base_path: str) -> Tuple[str, str]:
+    return base_path + META_SUFFIX, base_path + VECTOR_SUFFIX
+
+
+def sidecar_exists(base_path: str) -> bool:
+    # .npy 最后写入，存在即说明整组文件完整
+    return os.path.exists(base_path + VECTOR_SUFFIX)
+
+
+def write_sidecar(base_path: str, records: Sequence[Dict], embeddings: Sequence[Sequence[float]],
+                  dtype: np.dtype = np.float32):
+    # 半精度集合的中间文件用 float16 落盘（见 vector_codec.sidecar_dtype），读取方按需转换
+    meta_path, vector_path = sidecar_paths(base_path)
+    vectors = np.asarray(embeddings, dtype=dtype)
+    if len(records) != len(vectors):
+        raise ValueError(f"Row count mismatch: {len(records)} records vs {len(vectors)} vectors")
+
+    with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+        for record in records:
+            meta = {k: v for k, v in record.items() if k != "embedding"}
+            f.write(json.dumps(meta, ensure_ascii=False) + "\n")
+    with open(vector_path + ".tmp", "wb") as f:
+        np.save(f, vectors)
+    os.replace(meta_path + ".tmp", meta_path)
+    os.replace(vector_path + ".tmp", vector_path)
+
+
+def read_sidecar(base_path: str) -> Tuple[List[Dict], np.ndarray]:
+    meta_path, vector_path = sidecar_paths(base_path)
+    with open(meta_path, "r", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    vectors = np.load(vector_path, mmap_mode="r")  # 内存映射，按需读取，不做浮点解析
+    if len(records) != len(vectors):
+        raise ValueError(f"Row count mismatch in {base_path}: {len(records)} vs {len(vectors)}")
+    return records, vectors
+
+
+def iter_sidecar_chunks(base_path: str, chunk_size: int) -> Iterator[Tuple[List[Dict], np.ndarray]]:
+    records, vectors = read_sidecar(base_path)
+    for start in range(0, len(records), chunk_size):
+        yield records[start:start + chunk_size], vectors[start:start + chunk_size]
+
+
+def list_sidecars(folder: str) -> List[str]:
+    return sorted(
+        os.path.join(folder, f[:-len(VECTOR_SUFFIX)])
+        for f in os.listdir(folder) if f.endswith(VECTOR_SUFFIX)
+    )